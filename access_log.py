@@ -0,0 +1,88 @@
+import sys
+import time
+import queue
+import random
+import threading
+
+# off: tidak ada log akses; access: satu baris per request;
+# headers: ditambah header request dan response (untuk debugging)
+LEVELS = ('off', 'access', 'headers')
+QUEUE_SIZE = 10000
+
+class AccessLogger:
+    """Log akses yang ditulis oleh thread latar belakang lewat antrean.
+
+    Thread pemroses request hanya memasukkan tuple mentah ke antrean; format
+    dan penulisan dikerjakan thread penulis. Request sukses bisa di-sampling,
+    request error (status >= 500) selalu dicatat. Jika antrean penuh, entri
+    dibuang dan dihitung di `dropped` supaya request tidak ikut menunggu.
+    """
+    def __init__(self, level='access', sample_rate=1.0, stream=None):
+        self.level = level
+        self.sample_rate = sample_rate
+        self.stream = stream
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.thread = None
+        self.dropped = 0
+
+    def configure(self, level=None, sample_rate=None):
+        if level is not None:
+            self.level = level
+        if sample_rate is not None:
+            self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+
+    def start(self):
+        # Dipanggil di tiap proses (thread tidak ikut tersalin saat fork)
+        if self.level == 'off':
+            return
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def log(self, address, request, response_head, size, duration):
+        """address, HttpRequest (atau None), bytes awal response, panjang response, durasi detik."""
+        if self.level == 'off' or self.thread is None:
+            return
+        error = response_head[9:10] == b'5'
+        if not error and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        try:
+            self.queue.put_nowait((time.time(), address, request, response_head, size, duration))
+        except queue.Full:
+            self.dropped += 1
+
+    def format(self, entry):
+        timestamp, address, request, response_head, size, duration = entry
+        if request is not None:
+            request_line = '{} {} {}'.format(request.method, request.target, request.version)
+        else:
+            request_line = '-'
+        status = response_head[9:12].decode('latin-1', 'replace')
+        line = '{} {}:{} "{}" {} {} {:.1f}ms'.format(
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)),
+            address[0], address[1], request_line, status, size, duration * 1000)
+        if self.level == 'headers':
+            parts = [line]
+            if request is not None:
+                parts.append(request.head.strip())
+            parts.append(response_head.split(b'\r\n\r\n', 1)[0].decode('latin-1', 'replace'))
+            line = '\n'.join(parts) + '\n' + '-' * 30
+        return line
+
+    def run(self):
+        stream = self.stream or sys.stdout
+        while True:
+            entries = [self.queue.get()]
+            # Tulis sekaligus semua yang sudah menumpuk
+            while len(entries) < 512:
+                try:
+                    entries.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                stream.write('\n'.join(self.format(e) for e in entries) + '\n')
+                if self.dropped:
+                    stream.write('[access log] {} entri dibuang karena antrean penuh\n'.format(self.dropped))
+                    self.dropped = 0
+                stream.flush()
+            except Exception:
+                pass
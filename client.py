@@ -16,6 +16,9 @@ DOTS = 6
 MARGIN = 50
 SPACING = (WIDTH - 2 * MARGIN) / (DOTS - 1)
 SERVER_ADDRESS = ("172.16.16.101", 8000)
+ROOM_ID = sys.argv[1] if len(sys.argv) > 1 else None
+USE_LONG_POLL = True
+LONG_POLL_SECONDS = 20
 
 BG_COLOR, DOT_COLOR, LINE_COLOR = (15, 23, 42), (203, 213, 225), (51, 65, 85)
 PLAYER_COLORS = {1: (250, 100, 100), 2: (100, 150, 250)}; BOX_COLORS = {1: (250, 100, 100, 100), 2: (100, 150, 250, 100)}
@@ -28,56 +31,101 @@ clock = pygame.time.Clock()
 class ClientInterface:
     def __init__(self):
         self.cookie = None
+        # Satu koneksi keep-alive dipakai ulang untuk semua request
+        self.sock = None
+        self.buffer = b""
+        # ETag state terakhir dan response state penuh terakhir untuk /gamestate
+        self.state_etag = None
+        self.last_full_state = None
 
-    def send_command(self, method, path, body=None):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            sock.settimeout(10.0)
-            sock.connect(SERVER_ADDRESS)
-            
-            body_str = json.dumps(body) if body else ""
-            
-            headers = [
-                f"{method} {path} HTTP/1.1",
-                f"Host: {SERVER_ADDRESS[0]}:{SERVER_ADDRESS[1]}",
-                "Connection: close", "Accept: application/json",
-                "User-Agent: ManualSocketClient/1.2"
-            ]
-            if self.cookie: headers.append(f"Cookie: {self.cookie}")
-            if body_str:
-                headers.append("Content-Type: application/json")
-                headers.append(f"Content-Length: {len(body_str)}")
-
-            request = "\r\n".join(headers) + "\r\n\r\n" + body_str
-            sock.sendall(request.encode('utf-8'))
-
-            response_bytes = b""
-            while True:
-                try:
-                    chunk = sock.recv(4096)
-                    if not chunk: break
-                    response_bytes += chunk
-                except socket.timeout: break
-            
-            if not response_bytes: return None
-            
-            header_part, body_part = response_bytes.split(b'\r\n\r\n', 1)
-            
-            for line in header_part.decode('utf-8', errors='ignore').split('\r\n'):
-                if 'set-cookie:' in line.lower():
-                    self.cookie = line.split(':', 1)[1].strip().split(';')[0]
-            
-            if body_part:
-                return json.loads(body_part.decode('utf-8'))
-            return {"status": "OK"}
-        except Exception as e:
-            logging.error(f"Error di send_command: {e}")
-            return None
-        finally:
-            sock.close()
-
-    def join(self): return self.send_command('GET', '/join')
-    def get_state(self): return self.send_command('GET', '/gamestate')
+    def close(self):
+        if self.sock:
+            try: self.sock.close()
+            except OSError: pass
+        self.sock = None
+        self.buffer = b""
+
+    def read_response(self):
+        while b'\r\n\r\n' not in self.buffer:
+            chunk = self.sock.recv(4096)
+            if not chunk: raise ConnectionError("Koneksi ditutup server")
+            self.buffer += chunk
+        header_part, rest = self.buffer.split(b'\r\n\r\n', 1)
+        header_lines = header_part.decode('utf-8', errors='ignore').split('\r\n')
+        content_length, keep_alive = 0, True
+        for line in header_lines[1:]:
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'content-length': content_length = int(value.strip())
+            elif name.strip().lower() == 'connection': keep_alive = value.strip().lower() != 'close'
+        while len(rest) < content_length:
+            chunk = self.sock.recv(4096)
+            if not chunk: raise ConnectionError("Koneksi ditutup server")
+            rest += chunk
+        self.buffer = rest[content_length:]
+        return header_lines, rest[:content_length], keep_alive
+
+    def send_command(self, method, path, body=None, timeout=10.0, etag=None):
+        body_str = json.dumps(body) if body else ""
+        
+        headers = [
+            f"{method} {path} HTTP/1.1",
+            f"Host: {SERVER_ADDRESS[0]}:{SERVER_ADDRESS[1]}",
+            "Connection: keep-alive", "Accept: application/json",
+            "User-Agent: ManualSocketClient/1.2"
+        ]
+        if self.cookie: headers.append(f"Cookie: {self.cookie}")
+        if etag: headers.append(f"If-None-Match: {etag}")
+        if body_str:
+            headers.append("Content-Type: application/json")
+            headers.append(f"Content-Length: {len(body_str)}")
+        request = ("\r\n".join(headers) + "\r\n\r\n" + body_str).encode('utf-8')
+
+        for attempt in range(2):
+            reused = self.sock is not None
+            try:
+                if self.sock is None:
+                    self.sock = socket.create_connection(SERVER_ADDRESS, timeout=timeout)
+                self.sock.settimeout(timeout)
+                self.sock.sendall(request)
+                header_lines, body_part, keep_alive = self.read_response()
+                if not keep_alive: self.close()
+                
+                for line in header_lines:
+                    if 'set-cookie:' in line.lower():
+                        self.cookie = line.split(':', 1)[1].strip().split(';')[0]
+                    elif line.lower().startswith('x-server-time:'):
+                        update_clock_offset(float(line.split(':', 1)[1].strip()))
+                    elif line.lower().startswith('etag:') and path.startswith('/gamestate'):
+                        self.state_etag = line.split(':', 1)[1].strip()
+                
+                if header_lines[0].split(' ')[1:2] == ['304']:
+                    # State di server sama dengan yang sudah dimiliki client
+                    if path == '/gamestate' and self.last_full_state is not None:
+                        return self.last_full_state
+                    return {"status": "OK", "not_modified": True}
+                if body_part:
+                    response = json.loads(body_part.decode('utf-8'))
+                    if path == '/gamestate' and isinstance(response, dict) and 'state' in response:
+                        self.last_full_state = response
+                    return response
+                return {"status": "OK"}
+            except (ConnectionError, BrokenPipeError) as e:
+                self.close()
+                # Koneksi lama mungkin sudah ditutup server karena idle, coba sekali lagi
+                if reused and attempt == 0: continue
+                logging.error(f"Error di send_command: {e}")
+                return None
+            except Exception as e:
+                self.close()
+                logging.error(f"Error di send_command: {e}")
+                return None
+
+    def join(self, room_id=None): return self.send_command('GET', f'/join?room={room_id}' if room_id else '/join')
+    def get_state(self, since=None):
+        return self.send_command('GET', f'/gamestate?since={since}' if since is not None else '/gamestate', etag=self.state_etag)
+    def wait_state(self, since, wait):
+        # Long-poll: server menahan request sampai versi state berubah atau `wait` detik habis
+        return self.send_command('GET', f'/gamestate?since={since}&wait={wait}', timeout=wait + 10.0)
     def send_action(self, action, params=[]):
         return self.send_command('POST', '/action', {'action': action, 'params': params})
 
@@ -87,36 +135,109 @@ class ConnectionManager:
         self.latest_state = None
         self.action_queue = queue.Queue()
         self.my_id = None
+        self.room_id = None
         self.is_connected = False
         self.running = True
         self.client_interface = ClientInterface()
+        self.poll_interface = ClientInterface()
 
     def network_loop(self):
-        response = self.client_interface.join()
+        response = self.client_interface.join(ROOM_ID)
         if response and response.get('player_id'):
             with self.lock:
                 self.is_connected = True
                 self.my_id = int(response['player_id'].replace('player', ''))
-            logging.info(f"Bergabung sebagai {response['player_id']}")
+                self.room_id = response.get('room_id')
+            logging.info(f"Bergabung sebagai {response['player_id']} di room {self.room_id}")
         else:
             logging.error(f"Gagal bergabung. Respons: {response}")
             self.running = False
             return
 
+        if USE_LONG_POLL:
+            # Perubahan state diterima lewat long-poll di thread terpisah,
+            # loop ini cukup mengirim aksi pemain
+            self.poll_interface.cookie = self.client_interface.cookie
+            threading.Thread(target=self.poll_loop, daemon=True).start()
+
         while self.running:
+            version = None
             try:
                 action_data = self.action_queue.get(timeout=0.2)
                 response = self.client_interface.send_action(action_data['action'], action_data.get('params', []))
             except queue.Empty:
-                response = self.client_interface.get_state()
+                if USE_LONG_POLL:
+                    continue
+                version = self.state_version()
+                response = self.client_interface.get_state(version)
             
-            if response and response.get('status') == 'OK' and 'state' in response:
-                with self.lock:
-                    self.latest_state = response.get('state')
-            elif response:
-                logging.warning(f"Server error atau respons tidak lengkap: {response}")
+            self.handle_response(response, version)
             time.sleep(0.1)
 
+    def poll_loop(self):
+        while self.running:
+            version = self.state_version()
+            if version is None:
+                response = self.poll_interface.get_state()
+            else:
+                response = self.poll_interface.wait_state(version, LONG_POLL_SECONDS)
+            if not self.handle_response(response, version):
+                time.sleep(0.5)
+
+    def handle_response(self, response, since=None):
+        if response and response.get('status') == 'OK' and self.apply_state_response(response, since):
+            return True
+        if response:
+            logging.warning(f"Server error atau respons tidak lengkap: {response}")
+        return False
+
+    def state_version(self):
+        with self.lock:
+            return self.latest_state.get('version') if self.latest_state else None
+
+    def apply_state_response(self, response, since=None):
+        # State baru dibuat sebagai salinan supaya thread render tidak melihat state setengah jadi
+        with self.lock:
+            current = self.latest_state.get('version') if self.latest_state else None
+            if 'state' in response:
+                version = response['state'].get('version')
+                if current is not None and version is not None and version < current:
+                    return True
+                self.latest_state = response['state']
+                return True
+            if self.latest_state is None:
+                return False
+            if since != current:
+                # State sudah diganti response lain sejak request ini dikirim, delta ini basi
+                return True
+            if response.get('not_modified'):
+                return True
+            if 'delta' not in response:
+                return False
+            state = dict(self.latest_state)
+            delta = response['delta']
+            state['lines'] = state['lines'] + delta['lines']
+            state['boxes'] = state['boxes'] + delta['boxes']
+            state.update(delta['changes'])
+            state['version'] = response['version']
+            self.latest_state = state
+            return True
+
+# Selisih jam server terhadap jam lokal, diperbarui dari header X-Server-Time
+server_clock_offset = 0.0
+
+def update_clock_offset(server_time):
+    global server_clock_offset
+    server_clock_offset = server_time - time.time()
+
+def countdown_left(state):
+    # Server mengirim deadline absolut; sisa waktu dihitung di client memakai
+    # jam lokal yang dikoreksi ke jam server
+    deadline = state.get('countdown_deadline')
+    if not deadline:
+        return 0
+    return max(0, deadline - (time.time() + server_clock_offset))
+
 def get_line_rects():
     lines = []
     for r in range(DOTS):
@@ -129,8 +250,8 @@ def draw_lobby_view(screen, state, my_id):
     font_title=pygame.font.SysFont("consolas", 60); font_main=pygame.font.SysFont("consolas", 30)
     screen.fill(BG_COLOR); title = font_title.render("Dots & Boxes", True, WHITE); screen.blit(title, (WIDTH / 2 - title.get_width() / 2, 80))
     countdown_text = None
-    if state['game_state'] == "STARTING": countdown_text = f"Starting in {math.ceil(state['countdown'])}..."
-    elif state['game_state'] == "RESUMING": countdown_text = f"Resuming in {math.ceil(state['countdown'])}..."
+    if state['game_state'] == "STARTING": countdown_text = f"Starting in {math.ceil(countdown_left(state))}..."
+    elif state['game_state'] == "RESUMING": countdown_text = f"Resuming in {math.ceil(countdown_left(state))}..."
     if countdown_text: render_countdown = font_main.render(countdown_text, True, WHITE); screen.blit(render_countdown, (WIDTH / 2 - render_countdown.get_width() / 2, 180))
     
     all_players_joined = len(state['players']) >= 2
@@ -172,7 +293,7 @@ def draw_game_view(screen, state, my_id):
     elif state.get('game_state') == "RESUMING":
         paused_by_id=int(state['paused_by'].replace('player',''));
         if my_id != paused_by_id:
-            countdown_text = f"Resuming in {math.ceil(state['countdown'])}..."; countdown_render = font_pause.render(countdown_text, True, WHITE)
+            countdown_text = f"Resuming in {math.ceil(countdown_left(state))}..."; countdown_render = font_pause.render(countdown_text, True, WHITE)
             screen.blit(countdown_render, (WIDTH / 2 - countdown_render.get_width() / 2, HEIGHT / 2 - countdown_render.get_height() / 2))
     if overlay_text_bottom: back_text_render = font_main.render(overlay_text_bottom, True, WHITE); screen.blit(back_text_render, (WIDTH/2 - back_text_render.get_width()/2, HEIGHT - 50))
 
@@ -180,7 +301,7 @@ def draw_finished_view(screen, state):
     font_winner=pygame.font.SysFont("consolas",70); font_countdown=pygame.font.SysFont("consolas",30); screen.fill(BG_COLOR)
     winner_id = state.get('winner'); win_text = "GAME TIED!" if winner_id == 0 else f"PLAYER {winner_id} WINS!"
     render_winner = font_winner.render(win_text, True, WHITE); screen.blit(render_winner, (WIDTH / 2 - render_winner.get_width() / 2, HEIGHT / 2 - render_winner.get_height() / 2 - 30))
-    countdown_text=f"Returning to lobby in {math.ceil(state['countdown'])}..."; render_countdown = font_countdown.render(countdown_text, True, GREY)
+    countdown_text=f"Returning to lobby in {math.ceil(countdown_left(state))}..."; render_countdown = font_countdown.render(countdown_text, True, GREY)
     screen.blit(render_countdown, (WIDTH/2 - render_countdown.get_width()/2, HEIGHT / 2 + 50))
 
 def main():
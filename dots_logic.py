@@ -2,11 +2,16 @@ import json
 import logging
 import time
 import random
+from bisect import bisect_right
 
 DOTS = 6
 COUNTDOWN_SECONDS = 5
 FINISH_DELAY_SECONDS = 5
 
+# Field state selain lines/boxes yang dilacak versinya untuk delta
+TRACKED_FIELDS = ('board_size', 'current_turn', 'players', 'winner', 'player_count',
+                  'game_state', 'player_ready', 'paused_by', 'countdown_deadline')
+
 class DotsAndBoxesLogic:
     def __init__(self):
         self.players = {}
@@ -20,12 +25,31 @@ class DotsAndBoxesLogic:
         self.paused_by = None
         self.game_finished_time = None
         self.board_size = DOTS
+        # Representasi bitset papan: satu bit per garis horizontal ('row'),
+        # per garis vertikal ('col') dan per kotak untuk tiap pemilik.
+        self.h_lines = 0
+        self.v_lines = 0
+        self.box_bits = {1: 0, 2: 0}
+        # Versi state naik setiap kali ada perubahan. lines/boxes hanya
+        # bertambah di antara dua reset, jadi cukup dicatat versi saat tiap
+        # elemen ditambahkan; field lain dicatat versi perubahan terakhirnya.
+        self.version = 0
+        self.reset_version = 0
+        self.line_versions = []
+        self.box_versions = []
+        self.field_versions = {}
+        self.board_cleared = False
         self.reset_game()
+        self.board_cleared = False
+        self.last_fields = self._tracked_fields()
 
     def reset_game(self, params=None):
         current_players = self.players.copy()
         self.lines = []
         self.boxes = []
+        self.h_lines = 0
+        self.v_lines = 0
+        self.box_bits = {1: 0, 2: 0}
         self.winner = None
         self.current_turn = None
         self.game_state = "LOBBY"
@@ -34,15 +58,72 @@ class DotsAndBoxesLogic:
         self.game_finished_time = None
         self.players = current_players
         self.player_ready = {pid: False for pid in self.players}
+        self.board_cleared = True
         logging.info("Game state has been reset to LOBBY.")
 
+    def _tracked_fields(self):
+        return {
+            'board_size': self.board_size,
+            'current_turn': self.current_turn,
+            'players': dict(self.players),
+            'winner': self.winner,
+            'player_count': len(self.players),
+            'game_state': self.game_state,
+            'player_ready': dict(self.player_ready),
+            'paused_by': self.paused_by,
+            'countdown_deadline': self.next_deadline()
+        }
+
+    def commit(self):
+        """Naikkan versi jika ada perubahan sejak commit terakhir."""
+        fields = self._tracked_fields()
+        changed = [f for f in TRACKED_FIELDS if fields[f] != self.last_fields.get(f)]
+        new_lines = len(self.lines) - len(self.line_versions)
+        new_boxes = len(self.boxes) - len(self.box_versions)
+        if not (changed or new_lines or new_boxes or self.board_cleared):
+            return self.version
+        self.version += 1
+        if self.board_cleared:
+            self.board_cleared = False
+            self.reset_version = self.version
+            self.line_versions = [self.version] * len(self.lines)
+            self.box_versions = [self.version] * len(self.boxes)
+        else:
+            self.line_versions.extend([self.version] * new_lines)
+            self.box_versions.extend([self.version] * new_boxes)
+        for f in changed:
+            self.field_versions[f] = self.version
+        self.last_fields = fields
+        return self.version
+
+    def get_delta(self, since):
+        """Perubahan sejak versi `since`.
+
+        Mengembalikan state penuh jika `since` tidak bisa dipakai (sebelum reset
+        terakhir atau versi tak dikenal), penanda not_modified jika belum ada
+        perubahan, atau hanya lines/boxes baru dan field yang berubah.
+        """
+        if since is None or since < self.reset_version or since > self.version:
+            return {'version': self.version, 'state': self.get_state()}
+        if since == self.version:
+            return {'version': self.version, 'not_modified': True}
+        line_start = bisect_right(self.line_versions, since)
+        box_start = bisect_right(self.box_versions, since)
+        fields = self.last_fields
+        return {
+            'version': self.version,
+            'delta': {
+                'lines': self.lines[line_start:],
+                'boxes': self.boxes[box_start:],
+                'changes': {f: fields[f] for f, v in self.field_versions.items() if v > since}
+            }
+        }
+
     def get_state(self):
-        countdown = 0
-        if self.game_state in ("STARTING", "RESUMING") and self.countdown_start_time:
-            countdown = max(0, COUNTDOWN_SECONDS - (time.time() - self.countdown_start_time))
-        elif self.game_state == "FINISHED" and self.game_finished_time:
-            countdown = max(0, FINISH_DELAY_SECONDS - (time.time() - self.game_finished_time))
+        # Countdown dikirim sebagai deadline absolut (epoch), bukan sisa waktu,
+        # supaya state hanya berubah saat versinya berubah dan bisa di-cache
         return {
+            'version': self.version,
             'board_size': self.board_size,
             'lines': self.lines,
             'boxes': self.boxes,
@@ -52,19 +133,17 @@ class DotsAndBoxesLogic:
             'player_count': len(self.players),
             'game_state': self.game_state,
             'player_ready': self.player_ready,
-            'countdown': countdown,
+            'countdown_deadline': self.next_deadline(),
             'paused_by': self.paused_by
         }
 
     def assign_player(self):
-        if 'player1' not in self.players:
-            self.players['player1'] = {}
-            self.player_ready['player1'] = False
-            return 'player1'
-        if 'player2' not in self.players:
-            self.players['player2'] = {}
-            self.player_ready['player2'] = False
-            return 'player2'
+        for pid in ('player1', 'player2'):
+            if pid not in self.players:
+                self.players[pid] = {}
+                self.player_ready[pid] = False
+                self.commit()
+                return pid
         return None
 
     def player_disconnected(self, player_id):
@@ -75,25 +154,37 @@ class DotsAndBoxesLogic:
             if self.game_state != "LOBBY":
                 logging.info("A player disconnected during the game. Resetting to lobby.")
                 self.reset_game()
+            self.commit()
 
     def make_move(self, params=[]):
         pid_str, line_type, row_str, col_str = params
         pid = int(pid_str)
         if self.game_state != "PLAYING" or pid != self.current_turn:
             return
-        move = {'type': line_type, 'pos': (int(row_str), int(col_str))}
-        if any(l['type'] == move['type'] and tuple(l['pos']) == move['pos'] for l in self.lines):
+        row, col = int(row_str), int(col_str)
+        bit = self._line_bit(line_type, row, col)
+        if bit is None:
             return
-        self.lines.append({'type': line_type, 'pos': move['pos'], 'owner': pid})
-        if self._check_new_boxes(pid) == 0:
+        if line_type == 'row':
+            if self.h_lines & bit:
+                return
+            self.h_lines |= bit
+        else:
+            if self.v_lines & bit:
+                return
+            self.v_lines |= bit
+        self.lines.append({'type': line_type, 'pos': (row, col), 'owner': pid})
+        if self._check_new_boxes(pid, line_type, row, col) == 0:
             self.current_turn = 2 if self.current_turn == 1 else 1
-        if len(self.boxes) == (self.board_size - 1) ** 2 and self.game_state != "FINISHED":
-            s1 = sum(1 for b in self.boxes if b['owner'] == 1)
-            s2 = sum(1 for b in self.boxes if b['owner'] == 2)
+        if (self.box_bits[1] | self.box_bits[2]) == self._all_boxes_mask() and self.game_state != "FINISHED":
+            s1, s2 = self.score(1), self.score(2)
             self.winner = 1 if s1 > s2 else 2 if s2 > s1 else 0
             self.game_state = "FINISHED"
             self.game_finished_time = time.time()
 
+    def score(self, player_id):
+        return self.box_bits.get(player_id, 0).bit_count()
+
     def proses_command(self, player_id, command):
         action = command.get('action')
         if action == 'make_move':
@@ -124,6 +215,8 @@ class DotsAndBoxesLogic:
             elif self.game_state == "PAUSED" and self.paused_by != player_id:
                 logging.info("Both players left the paused game. Resetting to lobby.")
                 self.reset_game()
+        # Transisi yang langsung dipicu perintah (mis. kedua pemain READY)
+        self.update()
         return {'status':'OK', 'state': self.get_state()}
 
     def update(self):
@@ -145,20 +238,52 @@ class DotsAndBoxesLogic:
             if time.time() - self.game_finished_time >= FINISH_DELAY_SECONDS:
                 logging.info("Game finished. Resetting to lobby automatically.")
                 self.reset_game()
+        self.commit()
+
+    def next_deadline(self):
+        """Waktu (epoch) transisi berikutnya yang dipicu waktu, atau None jika tidak ada."""
+        if self.game_state in ("STARTING", "RESUMING") and self.countdown_start_time:
+            return self.countdown_start_time + COUNTDOWN_SECONDS
+        if self.game_state == "FINISHED" and self.game_finished_time:
+            return self.game_finished_time + FINISH_DELAY_SECONDS
+        return None
+
+    def _line_bit(self, line_type, row, col):
+        n = self.board_size
+        if line_type == 'row' and 0 <= row < n and 0 <= col < n - 1:
+            return 1 << (row * (n - 1) + col)
+        if line_type == 'col' and 0 <= row < n - 1 and 0 <= col < n:
+            return 1 << (row * n + col)
+        return None
+
+    def _all_boxes_mask(self):
+        return (1 << ((self.board_size - 1) ** 2)) - 1
+
+    def _is_box_closed(self, r, c):
+        n = self.board_size
+        top = 1 << (r * (n - 1) + c)
+        bottom = 1 << ((r + 1) * (n - 1) + c)
+        left = 1 << (r * n + c)
+        right = 1 << (r * n + c + 1)
+        return (self.h_lines & top and self.h_lines & bottom
+                and self.v_lines & left and self.v_lines & right)
 
-    def _check_new_boxes(self, player_id):
+    def _check_new_boxes(self, player_id, line_type, row, col):
+        # Garis baru hanya bisa menutup paling banyak dua kotak di sebelahnya
+        n = self.board_size
+        if line_type == 'row':
+            candidates = [(row - 1, col), (row, col)]
+        else:
+            candidates = [(row, col - 1), (row, col)]
+        filled = self.box_bits[1] | self.box_bits[2]
         new_boxes = 0
-        all_lines = {(l['type'], tuple(l['pos'])) for l in self.lines}
-        for r in range(self.board_size - 1):
-            for c in range(self.board_size - 1):
-                if (r, c) not in [b['pos'] for b in self.boxes] and all(
-                    t in all_lines for t in [
-                        ('row', (r, c)),
-                        ('row', (r + 1, c)),
-                        ('col', (r, c)),
-                        ('col', (r, c + 1))
-                    ]
-                ):
-                    self.boxes.append({'pos': (r, c), 'owner': player_id})
-                    new_boxes += 1
+        for r, c in candidates:
+            if not (0 <= r < n - 1 and 0 <= c < n - 1):
+                continue
+            box_bit = 1 << (r * (n - 1) + c)
+            if filled & box_bit or not self._is_box_closed(r, c):
+                continue
+            self.box_bits[player_id] |= box_bit
+            self.boxes.append({'pos': (r, c), 'owner': player_id})
+            new_boxes += 1
         return new_boxes
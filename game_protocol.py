@@ -0,0 +1,69 @@
+import struct
+
+# Setiap frame: panjang payload (4 byte) + ID request (4 byte) + payload JSON.
+# ID request dipakai untuk mencocokkan response dengan request-nya sehingga
+# satu koneksi bisa membawa banyak request sekaligus (pipelining).
+FRAME_HEADER = struct.Struct('!II')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+# Semua response sukses dari game state server diawali dengan byte ini, jadi
+# worker bisa meneruskan response apa adanya tanpa decode JSON terlebih dulu.
+OK_PREFIX = b'{"status": "OK"'
+# Response state dari game state server diawali ETag room (inkarnasi.versi)
+ETAG_PREFIX = b'{"status": "OK", "etag": "'
+# Kode error jika session_id tidak dikenal atau sudah kedaluwarsa
+NO_SESSION = 'NO_SESSION'
+
+class ProtocolError(Exception):
+	pass
+
+def encode_frame(request_id, payload):
+	if isinstance(payload, str):
+		payload = payload.encode('utf-8')
+	if len(payload) > MAX_FRAME_SIZE:
+		raise ProtocolError(f"Frame too large: {len(payload)} bytes")
+	return FRAME_HEADER.pack(len(payload), request_id) + payload
+
+class FrameReader:
+	def __init__(self, sock, bufsize=65536):
+		self.sock = sock
+		self.bufsize = bufsize
+		self.buffer = bytearray()
+
+	def feed(self, data):
+		self.buffer += data
+
+	def next_frame(self):
+		"""Ambil satu frame lengkap dari buffer, atau None jika belum lengkap."""
+		if len(self.buffer) < FRAME_HEADER.size:
+			return None
+		length, request_id = FRAME_HEADER.unpack_from(self.buffer)
+		if length > MAX_FRAME_SIZE:
+			raise ProtocolError(f"Frame too large: {length} bytes")
+		end = FRAME_HEADER.size + length
+		if len(self.buffer) < end:
+			return None
+		payload = bytes(self.buffer[FRAME_HEADER.size:end])
+		del self.buffer[:end]
+		return request_id, payload
+
+	def read_frame(self):
+		"""Blok sampai satu frame lengkap diterima. Mengembalikan None saat EOF."""
+		while True:
+			frame = self.next_frame()
+			if frame is not None:
+				return frame
+			chunk = self.sock.recv(self.bufsize)
+			if not chunk:
+				if self.buffer:
+					raise ProtocolError("Connection closed in the middle of a frame")
+				return None
+			self.buffer += chunk
+
+def response_etag(raw):
+	"""ETag di awal response state dari game state server, atau None."""
+	if not raw or not raw.startswith(ETAG_PREFIX):
+		return None
+	end = raw.find(b'"', len(ETAG_PREFIX))
+	if end < 0:
+		return None
+	return raw[len(ETAG_PREFIX):end].decode()
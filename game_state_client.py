@@ -2,74 +2,373 @@ import socket
 import json
 import logging
 import threading
+import itertools
 import time
+import contextlib
+from collections import deque
+from game_protocol import FrameReader, encode_frame
+from metrics import REGISTRY
+from tracing import TRACER, REQUEST_ID_FIELD, current_request_id
 
-class GameStateClient:
-	def __init__(self, host='127.0.0.1', port=9000):
+RPC_DURATION = REGISTRY.histogram('gss_rpc_duration_seconds', 'Latensi request worker ke game state server', ('action',))
+RPC_ERRORS = REGISTRY.counter('gss_rpc_errors_total', 'Request ke game state server yang gagal setelah semua percobaan', ('action',))
+
+class PendingCall:
+	def __init__(self, callback=None):
+		self.event = threading.Event()
+		self.payload = None
+		self.error = None
+		self.callback = callback
+
+	def complete(self, payload=None, error=None):
+		self.payload = payload
+		self.error = error
+		self.event.set()
+		if self.callback:
+			try:
+				self.callback(payload, error)
+			except Exception as e:
+				logging.error(f"Callback error: {e}")
+
+	def wait(self, timeout):
+		if not self.event.wait(timeout):
+			raise TimeoutError("Game State Server did not respond in time")
+		if self.error:
+			raise self.error
+		return self.payload
+
+class GameStateConnection:
+	"""Satu koneksi framed ke game state server.
+
+	Banyak thread boleh memakai koneksi ini bersamaan: request dikirim dengan
+	ID masing-masing dan thread pembaca mencocokkan response ke pemanggilnya.
+	"""
+	def __init__(self, host, port, timeout=5.0):
+		self.sock = socket.create_connection((host, port), timeout=timeout)
+		self.sock.settimeout(None)
+		self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.send_lock = threading.Lock()
+		self.pending = {}
+		self.pending_lock = threading.Lock()
+		self.ids = itertools.count(1)
+		self.alive = True
+		self.last_used = time.monotonic()
+		self.reader_thread = threading.Thread(target=self.read_loop, daemon=True)
+		self.reader_thread.start()
+
+	def submit(self, payload, callback=None):
+		request_id = next(self.ids) & 0xFFFFFFFF
+		call = PendingCall(callback)
+		with self.pending_lock:
+			if not self.alive:
+				raise ConnectionError("Connection to Game State Server is closed")
+			self.pending[request_id] = call
+		try:
+			with self.send_lock:
+				self.sock.sendall(encode_frame(request_id, payload))
+		except OSError:
+			with self.pending_lock:
+				self.pending.pop(request_id, None)
+			self.close()
+			raise
+		return call
+
+	def call(self, payload, timeout=10.0):
+		return self.submit(payload).wait(timeout)
+
+	def read_loop(self):
+		reader = FrameReader(self.sock)
+		error = ConnectionError("Connection to Game State Server lost")
+		try:
+			while True:
+				frame = reader.read_frame()
+				if frame is None:
+					break
+				request_id, payload = frame
+				with self.pending_lock:
+					call = self.pending.pop(request_id, None)
+				if call is None:
+					logging.warning(f"Response for unknown request id {request_id}")
+					continue
+				call.complete(payload)
+		except Exception as e:
+			error = ConnectionError(f"Connection to Game State Server lost: {e}")
+		finally:
+			self.close(error)
+
+	def close(self, error=None):
+		with self.pending_lock:
+			self.alive = False
+			pending, self.pending = self.pending, {}
+		for call in pending.values():
+			call.complete(error=error or ConnectionError("Connection to Game State Server closed"))
+		try:
+			self.sock.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass
+		try:
+			self.sock.close()
+		except OSError:
+			pass
+
+class PoolTimeout(Exception):
+	pass
+
+class ConnectionPool:
+	"""Pool koneksi ke game state server dengan batas ukuran.
+
+	Koneksi dipinjam secara eksklusif lewat checkout()/checkin(). Koneksi yang
+	terlalu lama menganggur ditutup (selama pool masih di atas min_size), dan
+	koneksi yang sudah lama tidak dipakai di-ping dulu sebelum dipinjamkan.
+	"""
+	def __init__(self, host, port, max_size=20, min_size=1, checkout_timeout=5.0,
+			idle_timeout=60.0, health_check_interval=30.0, connect_timeout=5.0):
 		self.host = host
 		self.port = port
-		self.socket = None
-		self.lock = threading.Lock()
-		self.connected = False
+		self.max_size = max_size
+		self.min_size = min_size
+		self.checkout_timeout = checkout_timeout
+		self.idle_timeout = idle_timeout
+		self.health_check_interval = health_check_interval
+		self.connect_timeout = connect_timeout
+		self.idle = deque()
+		self.size = 0
+		self.in_use = 0
+		self.cond = threading.Condition()
+		# Metrik pool
+		self.checkouts = 0
+		self.wait_time_total = 0.0
+		self.wait_time_max = 0.0
+		self.timeouts = 0
+		self.created = 0
+		self.evicted = 0
 
-	def connect(self):
+	def new_connection(self):
+		conn = GameStateConnection(self.host, self.port, self.connect_timeout)
+		with self.cond:
+			self.created += 1
+		logging.info(f"Connected to Game State Server at {self.host}:{self.port}")
+		return conn
+
+	def warm(self):
+		"""Buka koneksi sampai min_size. Mengembalikan False jika server tidak bisa dihubungi."""
+		conns = []
 		try:
-			s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-			s.connect((self.host, self.port))
-			self.socket = s
-			self.connected = True
-			logging.info(f"Connected to Game State Server at {self.host}:{self.port}")
+			for _ in range(self.min_size):
+				conns.append(self.checkout())
 			return True
 		except Exception as e:
 			logging.error(f"Failed to connect: {e}")
-			self.connected = False
 			return False
+		finally:
+			for conn in conns:
+				self.checkin(conn)
+
+	def checkout(self, timeout=None):
+		timeout = self.checkout_timeout if timeout is None else timeout
+		start = time.monotonic()
+		deadline = start + timeout
+		conn = None
+		stale = []
+		with self.cond:
+			while True:
+				stale.extend(self.evict_idle_locked(time.monotonic()))
+				while self.idle and conn is None:
+					conn = self.idle.pop()
+					if not conn.alive:
+						self.size -= 1
+						conn = None
+				if conn is not None or self.size < self.max_size:
+					if conn is None:
+						self.size += 1
+					break
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					self.timeouts += 1
+					raise PoolTimeout(f"No Game State Server connection available after {timeout}s")
+				self.cond.wait(remaining)
+			self.in_use += 1
+			waited = time.monotonic() - start
+			self.checkouts += 1
+			self.wait_time_total += waited
+			self.wait_time_max = max(self.wait_time_max, waited)
+		for old in stale:
+			old.close()
+
+		try:
+			if conn is not None and time.monotonic() - conn.last_used > self.health_check_interval:
+				if not self.ping(conn):
+					conn.close()
+					conn = None
+			if conn is None:
+				conn = self.new_connection()
+		except Exception:
+			self.release_slot()
+			raise
+		return conn
+
+	def ping(self, conn):
+		try:
+			resp = json.loads(conn.call(b'{"action":"ping"}', timeout=1.0).decode('utf-8'))
+			return resp.get('status') == 'OK'
+		except Exception as e:
+			logging.warning(f"Health check failed for pooled connection: {e}")
+			return False
+
+	def checkin(self, conn):
+		with self.cond:
+			self.in_use -= 1
+			if conn.alive:
+				conn.last_used = time.monotonic()
+				self.idle.append(conn)
+			else:
+				self.size -= 1
+			self.cond.notify()
+
+	def discard(self, conn):
+		conn.close()
+		self.release_slot()
+
+	def release_slot(self):
+		with self.cond:
+			self.in_use -= 1
+			self.size -= 1
+			self.cond.notify()
+
+	def evict_idle_locked(self, now):
+		# Koneksi paling lama menganggur ada di sisi kiri deque
+		stale = []
+		while self.idle and self.size > self.min_size and now - self.idle[0].last_used > self.idle_timeout:
+			stale.append(self.idle.popleft())
+			self.size -= 1
+			self.evicted += 1
+		return stale
+
+	@contextlib.contextmanager
+	def connection(self, timeout=None):
+		conn = self.checkout(timeout)
+		try:
+			yield conn
+		except Exception:
+			self.discard(conn)
+			raise
+		else:
+			self.checkin(conn)
+
+	def close_all(self):
+		with self.cond:
+			idle, self.idle = list(self.idle), deque()
+			self.size -= len(idle)
+			self.cond.notify_all()
+		for conn in idle:
+			conn.close()
+
+	def stats(self):
+		with self.cond:
+			return {
+				'size': self.size,
+				'in_use': self.in_use,
+				'idle': len(self.idle),
+				'max_size': self.max_size,
+				'checkouts': self.checkouts,
+				'wait_time_total': self.wait_time_total,
+				'wait_time_max': self.wait_time_max,
+				'wait_time_avg': self.wait_time_total / self.checkouts if self.checkouts else 0.0,
+				'timeouts': self.timeouts,
+				'created': self.created,
+				'evicted': self.evicted,
+			}
+
+class GameStateClient:
+	def __init__(self, host='127.0.0.1', port=9000, timeout=10.0, pool_size=20):
+		self.host = host
+		self.port = port
+		self.timeout = timeout
+		self.pool = ConnectionPool(host, port, max_size=pool_size)
+		# Koneksi terpisah khusus long-poll: request watch bisa tertahan lama,
+		# jadi tidak boleh memakai slot pool, cukup dimultipleks di satu koneksi.
+		self.watch_connection = None
+		self.watch_lock = threading.Lock()
+
+	def connect(self):
+		return self.pool.warm()
 
 	def disconnect(self):
-		with self.lock:
-			if self.socket:
-				try:
-					self.socket.close()
-				except:
-					pass
-				self.socket = None
-			self.connected = False
+		self.pool.close_all()
 
-	def send_request(self, data):
+	def pool_stats(self):
+		return self.pool.stats()
+
+	def send_request_raw(self, data):
+		"""Seperti send_request, tapi mengembalikan bytes JSON mentah (None jika gagal)."""
 		retries = 3
+		action = data.get('action')
+		request_id = current_request_id()
+		if request_id:
+			# ID request ikut dikirim supaya span di game state server bisa dikaitkan
+			data = dict(data, **{REQUEST_ID_FIELD: request_id})
+		payload = json.dumps(data).encode('utf-8')
+		started = time.monotonic()
 		for attempt in range(retries):
+			attempt_started = time.monotonic()
 			try:
-				with self.lock:
-					if not self.connected:
-						if not self.connect():
-							time.sleep(0.1)
-							continue
-					payload = json.dumps(data).encode('utf-8')
-					self.socket.sendall(payload)
-
-					resp = self.socket.recv(4096)
-					if not resp:
-						raise ConnectionError
-					return json.loads(resp.decode('utf-8'))
-
+				with self.pool.connection() as conn:
+					checked_out = time.monotonic()
+					resp = conn.call(payload, self.timeout)
+				RPC_DURATION.observe(time.monotonic() - started, action)
+				if request_id:
+					TRACER.span('gsc.checkout', request_id, attempt_started, ended=checked_out)
+					TRACER.span('gsc.rpc', request_id, started, {'action': action, 'attempt': attempt + 1})
+				return resp
 			except Exception as e:
 				logging.error(f"Request error (attempt {attempt+1}): {e}")
-				self.disconnect()
 				time.sleep(0.1)
 		logging.error("Max retries reached")
-		return {'status':'ERROR'}
+		RPC_ERRORS.inc(action)
+		return None
+
+	def send_request(self, data):
+		resp = self.send_request_raw(data)
+		if resp is None:
+			return {'status':'ERROR'}
+		return json.loads(resp.decode('utf-8'))
+
+	def get_watch_connection(self):
+		with self.watch_lock:
+			if self.watch_connection is None or not self.watch_connection.alive:
+				self.watch_connection = GameStateConnection(self.host, self.port)
+			return self.watch_connection
+
+	def watch(self, room_id, since, timeout, callback):
+		"""Long-poll tanpa memblok thread: callback(raw_response) dipanggil dari
+		thread pembaca saat versi state berubah atau timeout habis (None jika gagal)."""
+		def on_done(payload, error):
+			if error:
+				logging.error(f"Watch error: {error}")
+			callback(payload)
+		payload = json.dumps({'action':'watch','room_id':room_id,'since':since,'timeout':timeout}).encode('utf-8')
+		try:
+			self.get_watch_connection().submit(payload, on_done)
+		except Exception as e:
+			logging.error(f"Watch error: {e}")
+			callback(None)
+
+	def get_delta_raw(self, room_id, since, etag=None):
+		return self.send_request_raw({'action':'get_delta','room_id':room_id,'since':since,'etag':etag})
 
-	def get_state(self):
-		return self.send_request({'action':'get_state'})
+	def assign_player(self, room_id=None, session=False):
+		return self.send_request({'action':'assign_player','room_id':room_id,'session':session})
 
-	def assign_player(self):
-		return self.send_request({'action':'assign_player'})
+	# Varian berbasis session: game state server mencari room dan pemain dari
+	# session_id sekaligus memperpanjang masa berlaku session tersebut
+	def get_session(self, session_id, extend=0):
+		return self.send_request({'action':'get_session','session_id':session_id,'extend':extend})
 
-	def player_disconnected(self, pid):
-		return self.send_request({'action':'player_disconnected','player_id':pid})
+	def session_state_raw(self, session_id, etag=None):
+		return self.send_request_raw({'action':'get_state','session_id':session_id,'etag':etag})
 
-	def process_command(self, pid, cmd):
-		return self.send_request({'action':'process_command','player_id':pid,'command':cmd})
+	def session_delta_raw(self, session_id, since, etag=None):
+		return self.send_request_raw({'action':'get_delta','session_id':session_id,'since':since,'etag':etag})
 
-	def update_game(self):
-		return self.send_request({'action':'update'})
+	def session_command_raw(self, session_id, cmd):
+		return self.send_request_raw({'action':'process_command','session_id':session_id,'command':cmd})
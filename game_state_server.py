@@ -1,73 +1,488 @@
 import socket
 import threading
 import json
+import math
 import time
+import uuid
 import logging
+import asyncio
+import argparse
+import heapq
+import itertools
 from dots_logic import DotsAndBoxesLogic
+from game_protocol import FrameReader, encode_frame, FRAME_HEADER, MAX_FRAME_SIZE, ProtocolError, NO_SESSION
+from metrics import REGISTRY, TimedLock, MetricsServer
+from tracing import TRACER, DEFAULT_TRACE_FILE, REQUEST_ID_FIELD
 
 logging.basicConfig(level=logging.INFO, format='GAME_STATE_SERVER - %(levelname)s: %(message)s')
 
+MAX_WATCH_TIMEOUT = 30.0
+MAX_CACHED_DELTAS = 32
+# Session yang tidak dipakai selama ini dianggap ditinggal pemainnya
+SESSION_TTL = 5.0
+METRICS_PORT = 9001
+ACTIONS = ('ping', 'assign_player', 'get_session', 'end_session', 'watch', 'player_disconnected',
+	'get_state', 'get_delta', 'process_command', 'update')
+
+REQUESTS = REGISTRY.counter('gss_requests_total', 'Request yang diterima game state server', ('action', 'status'))
+REQUEST_DURATION = REGISTRY.histogram('gss_request_duration_seconds', 'Waktu proses request di game state server', ('action',))
+
+class TimerHandle:
+	def __init__(self, deadline, seq, callback, args):
+		self.deadline = deadline
+		self.seq = seq
+		self.callback = callback
+		self.args = args
+		self.cancelled = False
+
+	def __lt__(self, other):
+		return (self.deadline, self.seq) < (other.deadline, other.seq)
+
+	def cancel(self):
+		self.cancelled = True
+
+class Scheduler:
+	"""Timer berbasis heap untuk mode threaded; padanan loop.call_later di mode asyncio."""
+	def __init__(self):
+		self.heap = []
+		self.seq = itertools.count()
+		self.cond = threading.Condition()
+		self.running = True
+
+	def call_later(self, delay, callback, *args):
+		handle = TimerHandle(time.monotonic() + delay, next(self.seq), callback, args)
+		with self.cond:
+			heapq.heappush(self.heap, handle)
+			if self.heap[0] is handle:
+				self.cond.notify()
+		return handle
+
+	def run(self):
+		while self.running:
+			with self.cond:
+				while self.running and (not self.heap or self.heap[0].deadline > time.monotonic()):
+					timeout = self.heap[0].deadline - time.monotonic() if self.heap else None
+					self.cond.wait(timeout)
+				if not self.running:
+					return
+				handle = heapq.heappop(self.heap)
+			if handle.cancelled:
+				continue
+			try:
+				handle.callback(*handle.args)
+			except Exception as e:
+				logging.error(f"Scheduled callback error: {e}")
+
+	def stop(self):
+		with self.cond:
+			self.running = False
+			self.cond.notify()
+
+class Watcher:
+	def __init__(self, since, reply):
+		self.since = since
+		self.reply = reply
+		self.timer = None
+
+class Session:
+	def __init__(self, session_id, room_id, player_id, expires_at):
+		self.session_id = session_id
+		self.room_id = room_id
+		self.player_id = player_id
+		self.expires_at = expires_at
+
+class SessionStore:
+	"""Session pemain yang bisa dipakai semua worker.
+
+	Kedaluwarsa diindeks dengan min-heap berisi satu entri per session. Saat
+	session dipakai cukup expires_at-nya yang dimajukan; entri heap baru
+	diperbarui ketika sampai di puncak heap. Hanya ada satu timer, yaitu untuk
+	entri paling awal, dan callback kedaluwarsa dijalankan di luar lock.
+	"""
+	def __init__(self, server, ttl=SESSION_TTL):
+		self.server = server
+		self.ttl = ttl
+		self.sessions = {}
+		self.heap = []
+		self.lock = threading.Lock()
+		self.timer = None
+		self.timer_at = None
+
+	def create(self, room_id, player_id):
+		session = Session(str(uuid.uuid4()), room_id, player_id, time.monotonic() + self.ttl)
+		with self.lock:
+			self.sessions[session.session_id] = session
+			heapq.heappush(self.heap, (session.expires_at, session.session_id))
+			self.arm_locked()
+		return session
+
+	def touch(self, session_id, extend=0):
+		"""Session yang masih hidup (masa berlakunya diperpanjang), atau None.
+		`extend` menambah masa berlaku, mis. selama request long-poll ditahan."""
+		with self.lock:
+			session = self.sessions.get(session_id)
+			if session is not None:
+				session.expires_at = max(session.expires_at, time.monotonic() + self.ttl + extend)
+			return session
+
+	def remove(self, session_id):
+		with self.lock:
+			return self.sessions.pop(session_id, None)
+
+	def arm_locked(self):
+		if not self.heap:
+			return
+		at = self.heap[0][0]
+		if self.timer is not None and self.timer_at <= at:
+			return
+		if self.timer is not None:
+			self.timer.cancel()
+		self.timer_at = at
+		self.timer = self.server.call_later(max(0, at - time.monotonic()), self.expire)
+
+	def expire(self):
+		expired = []
+		with self.lock:
+			self.timer = None
+			self.timer_at = None
+			now = time.monotonic()
+			while self.heap and self.heap[0][0] <= now:
+				_, session_id = heapq.heappop(self.heap)
+				session = self.sessions.get(session_id)
+				if session is None:
+					continue
+				if session.expires_at > now:
+					heapq.heappush(self.heap, (session.expires_at, session_id))
+					continue
+				del self.sessions[session_id]
+				expired.append(session)
+			self.arm_locked()
+		for session in expired:
+			self.server.session_expired(session)
+
+class Room:
+	def __init__(self, room_id, matchmaking=False):
+		self.room_id = room_id
+		# True untuk room yang dibuat otomatis oleh /join tanpa nama; hanya
+		# room seperti ini yang boleh diisi pemain acak
+		self.matchmaking = matchmaking
+		# Penanda acak per room (room dengan ID yang sama bisa dibuat ulang dan
+		# versinya mulai dari 0 lagi); ETag = inkarnasi.versi
+		self.incarnation = uuid.uuid4().hex[:16]
+		self.game_logic = DotsAndBoxesLogic()
+		# Satu label untuk semua room supaya jumlah seri metrik tidak ikut
+		# bertambah dengan jumlah room
+		self.lock = TimedLock('room')
+		# Request long-poll yang menunggu versi state berubah
+		self.watchers = []
+		# Timer untuk transisi berikutnya (countdown selesai, kembali ke lobby)
+		self.timer = None
+		self.timer_deadline = None
+		# Cache hasil encode JSON untuk versi state saat ini
+		self.cache_version = None
+		self.cached_state = None
+		self.cached_deltas = {}
+
+	def refresh_cache(self):
+		# Dipanggil dengan self.lock sudah dipegang
+		version = self.game_logic.version
+		if self.cache_version != version:
+			self.cache_version = version
+			self.cached_state = None
+			self.cached_deltas = {}
+
+	def etag(self):
+		# Room ID berasal dari client, jadi tidak ikut dimasukkan ke ETag
+		return '%s.%d' % (self.incarnation, self.game_logic.version)
+
+	def not_modified_response(self):
+		return '{"status": "OK", "etag": %s, "not_modified": true}' % json.dumps(self.etag())
+
+	def state_response(self):
+		"""Response {'status','etag','state'} yang sudah di-encode, dibuat sekali per versi."""
+		self.refresh_cache()
+		if self.cached_state is None:
+			self.cached_state = '{"status": "OK", "etag": %s, "state": %s}' % (
+				json.dumps(self.etag()), json.dumps(self.game_logic.get_state()))
+		return self.cached_state
+
+	def delta_response(self, since):
+		self.refresh_cache()
+		resp = self.cached_deltas.get(since)
+		if resp is None:
+			delta = self.game_logic.get_delta(since)
+			if 'state' in delta:
+				resp = self.state_response()[:-1] + ', "version": %d}' % delta['version']
+			else:
+				resp = json.dumps({'status': 'OK', 'etag': self.etag(), **delta})
+			if len(self.cached_deltas) < MAX_CACHED_DELTAS:
+				self.cached_deltas[since] = resp
+		return resp
+
+	def is_full(self):
+		return len(self.game_logic.players) >= 2
+
+	def is_empty(self):
+		return len(self.game_logic.players) == 0
+
 class GameStateServer:
 	def __init__(self, host='127.0.0.1', port=9000):
 		self.host = host
 		self.port = port
-		self.game_logic = DotsAndBoxesLogic()
-		self.lock = threading.Lock()
+		# Registry room; lock ini hanya dipakai saat membuat/menghapus room,
+		# state permainan tiap room dijaga oleh lock milik room itu sendiri.
+		self.rooms = {}
+		# Room matchmaking yang berisi satu pemain (menunggu lawan), urut sesuai
+		# waktu masuk; dict dipakai sebagai set berurutan. Dijaga oleh self.lock.
+		self.waiting_rooms = {}
+		self.lock = TimedLock('game_state_server')
 		self.running = True
+		self.scheduler = None
+		self.loop = None
+		self.sessions = SessionStore(self)
+		REGISTRY.gauge('gss_active_rooms', 'Room yang sedang ada', fn=lambda: len(self.rooms))
+		REGISTRY.gauge('gss_sessions', 'Session pemain yang masih berlaku', fn=lambda: len(self.sessions.sessions))
+		REGISTRY.gauge('gss_watchers', 'Request long-poll yang sedang menunggu', fn=lambda: sum(len(r.watchers) for r in list(self.rooms.values())))
+
+	def call_later(self, delay, callback, *args):
+		if self.loop is not None:
+			return self.loop.call_later(delay, callback, *args)
+		return self.scheduler.call_later(delay, callback, *args)
+
+	def get_room(self, room_id):
+		return self.rooms.get(room_id)
+
+	def _find_open_room(self):
+		# Room yang sudah berisi satu pemain agar cepat dapat lawan
+		return next(iter(self.waiting_rooms.values()), None)
+
+	def _update_waiting(self, room):
+		# Dipanggil dengan self.lock dan room.lock sudah dipegang
+		if room.matchmaking and len(room.game_logic.players) == 1:
+			self.waiting_rooms[room.room_id] = room
+		else:
+			self.waiting_rooms.pop(room.room_id, None)
 
-	def handle_request(self, data):
+	def assign_player(self, room_id=None):
+		with self.lock:
+			if room_id:
+				room = self.rooms.get(room_id)
+				if room is None:
+					room = Room(room_id)
+					self.rooms[room_id] = room
+					logging.info(f"Room {room_id} created")
+			else:
+				room = self._find_open_room()
+				if room is None:
+					room = Room(uuid.uuid4().hex[:8], matchmaking=True)
+					self.rooms[room.room_id] = room
+					logging.info(f"Room {room.room_id} created")
+			with room.lock:
+				pid = room.game_logic.assign_player()
+				self._update_waiting(room)
+			return room, pid
+
+	def player_left(self, room):
+		"""Perbarui registry setelah pemain keluar: room kosong dihapus,
+		room yang tinggal satu pemain kembali menunggu lawan."""
+		with self.lock:
+			with room.lock:
+				if self.rooms.get(room.room_id) is not room:
+					return
+				self._update_waiting(room)
+				if room.is_empty():
+					del self.rooms[room.room_id]
+					logging.info(f"Room {room.room_id} removed")
+
+	def disconnect_player(self, room, pid):
+		with room.lock:
+			room.game_logic.player_disconnected(pid)
+			resp = room.state_response()
+		self.after_mutation(room)
+		self.player_left(room)
+		return resp
+
+	def session_expired(self, session):
+		logging.info(f"Session {session.player_id} di room {session.room_id} kedaluwarsa")
+		room = self.get_room(session.room_id)
+		if room is not None:
+			self.disconnect_player(room, session.player_id)
+
+	def after_mutation(self, room):
+		self.schedule_room(room)
+		self.notify_watchers(room)
+
+	def schedule_room(self, room):
+		"""Pasang timer tepat di deadline transisi berikutnya milik room.
+
+		Room yang tidak sedang menghitung mundur tidak punya timer sama sekali.
+		"""
+		with room.lock:
+			deadline = room.game_logic.next_deadline()
+			if deadline == room.timer_deadline:
+				return
+			if room.timer:
+				room.timer.cancel()
+				room.timer = None
+			room.timer_deadline = deadline
+			if deadline is not None:
+				room.timer = self.call_later(max(0, deadline - time.time()), self.fire_room, room)
+
+	def fire_room(self, room):
+		with room.lock:
+			room.timer = None
+			room.timer_deadline = None
+			room.game_logic.update()
+		self.after_mutation(room)
+
+	def watch(self, room, since, timeout, reply):
+		"""Balas segera jika versi sudah berbeda dari `since`; jika belum, parkir
+		request sampai state berubah atau timeout habis."""
+		with room.lock:
+			if reply is None or timeout <= 0 or since != room.game_logic.version:
+				return room.delta_response(since)
+			watcher = Watcher(since, reply)
+			room.watchers.append(watcher)
+			watcher.timer = self.call_later(min(timeout, MAX_WATCH_TIMEOUT), self.expire_watcher, room, watcher)
+		return None
+
+	def expire_watcher(self, room, watcher):
+		with room.lock:
+			if watcher not in room.watchers:
+				return
+			room.watchers.remove(watcher)
+			resp = room.delta_response(watcher.since)
+		watcher.reply(resp)
+
+	def notify_watchers(self, room):
+		if not room.watchers:
+			return
+		with room.lock:
+			version = room.game_logic.version
+			ready = [w for w in room.watchers if w.since != version]
+			if not ready:
+				return
+			room.watchers = [w for w in room.watchers if w.since == version]
+			responses = [(w, room.delta_response(w.since)) for w in ready]
+		for watcher, resp in responses:
+			watcher.timer.cancel()
+			watcher.reply(resp)
+
+	def handle_request(self, data, reply=None):
+		"""Proses satu request. Mengembalikan None jika response akan dikirim
+		belakangan lewat `reply` (long-poll)."""
+		started = time.monotonic()
+		action = None
+		request_id = None
 		try:
 			req = json.loads(data.decode())
 			action = req.get('action')
-			with self.lock:
-				if action == 'get_state':
-					return json.dumps({'status':'OK','state':self.game_logic.get_state()})
-				elif action == 'assign_player':
-					pid = self.game_logic.assign_player()
-					if pid:
-						return json.dumps({'status':'OK','player_id':pid})
-					else:
-						return json.dumps({'status':'ERROR','message':'Game is full'})
-				elif action == 'player_disconnected':
-					pid = req.get('player_id')
-					self.game_logic.player_disconnected(pid)
-					return json.dumps({'status':'OK','state':self.game_logic.get_state()})
-				elif action == 'process_command':
-					pid = req.get('player_id')
-					cmd = req.get('command')
-					result = self.game_logic.proses_command(pid, cmd)
-					return json.dumps(result)
-				elif action == 'update':
-					self.game_logic.update()
-					return json.dumps({'status':'OK','state':self.game_logic.get_state()})
-				else:
-					return json.dumps({'status':'ERROR','message':'Unknown action'})
+			request_id = req.get(REQUEST_ID_FIELD)
+			resp = self.process_request(req, action, reply)
 		except Exception as e:
 			logging.error(f"Request error: {e}")
-			return json.dumps({'status':'ERROR','message':str(e)})
+			resp = json.dumps({'status':'ERROR','message':str(e)})
+		label = action if action in ACTIONS else 'unknown'
+		if resp is None:
+			# Long-poll: waktu tunggunya bukan latensi pemrosesan
+			status = 'deferred'
+		else:
+			status = 'OK' if resp.startswith('{"status": "OK"') else 'ERROR'
+			REQUEST_DURATION.observe(time.monotonic() - started, label)
+		REQUESTS.inc(label, status)
+		if request_id:
+			TRACER.span('gss.' + label, request_id, started, {'status': status})
+		return resp
+
+	def process_request(self, req, action, reply):
+		if action == 'ping':
+			return json.dumps({'status':'OK'})
+		if action == 'assign_player':
+			room, pid = self.assign_player(req.get('room_id'))
+			if pid:
+				self.after_mutation(room)
+				resp = {'status':'OK','player_id':pid,'room_id':room.room_id}
+				if req.get('session'):
+					resp['session_id'] = self.sessions.create(room.room_id, pid).session_id
+				return json.dumps(resp)
+			else:
+				return json.dumps({'status':'ERROR','message':'Game is full'})
+
+		# Request boleh menyebut session_id sebagai ganti room_id/player_id;
+		# sekaligus memperpanjang masa berlaku session tersebut
+		session_id = req.get('session_id')
+		if session_id:
+			session = self.sessions.touch(session_id, float(req.get('extend', 0)))
+			if session is None:
+				return json.dumps({'status':'ERROR','code':NO_SESSION,'message':'No session'})
+			if action == 'get_session':
+				return json.dumps({'status':'OK','room_id':session.room_id,'player_id':session.player_id})
+			if action == 'end_session':
+				self.sessions.remove(session_id)
+				action = 'player_disconnected'
+			req['room_id'] = session.room_id
+			req['player_id'] = session.player_id
+
+		room = self.get_room(req.get('room_id'))
+		if room is None:
+			return json.dumps({'status':'ERROR','message':'Unknown room'})
+
+		if action == 'watch':
+			timeout = float(req.get('timeout', 0))
+			# NaN merusak urutan heap timer; tolak sebelum sampai ke call_later
+			if not math.isfinite(timeout):
+				return json.dumps({'status':'ERROR','message':'Invalid timeout'})
+			return self.watch(room, req.get('since'), timeout, reply)
+
+		if action == 'player_disconnected':
+			return self.disconnect_player(room, req.get('player_id'))
+
+		with room.lock:
+			if action in ('get_state', 'get_delta') and req.get('etag') == room.etag():
+				# Client sudah punya versi ini; tidak perlu kirim state
+				return room.not_modified_response()
+			if action == 'get_state':
+				return room.state_response()
+			elif action == 'get_delta':
+				return room.delta_response(req.get('since'))
+			elif action == 'process_command':
+				pid = req.get('player_id')
+				cmd = req.get('command')
+				room.game_logic.proses_command(pid, cmd)
+				resp = room.state_response()
+			elif action == 'update':
+				room.game_logic.update()
+				resp = room.state_response()
+			else:
+				return json.dumps({'status':'ERROR','message':'Unknown action'})
+		self.after_mutation(room)
+		return resp
 
 	def handle_client(self, sock, addr):
+		reader = FrameReader(sock)
+		send_lock = threading.Lock()
+
+		def send(request_id, resp):
+			try:
+				with send_lock:
+					sock.sendall(encode_frame(request_id, resp))
+			except OSError as e:
+				logging.error(f"Send error {addr}: {e}")
+
 		try:
 			while self.running:
-				data = sock.recv(4096)
-				if not data: break
-				resp = self.handle_request(data)
-				sock.sendall(resp.encode())
+				frame = reader.read_frame()
+				if frame is None: break
+				request_id, data = frame
+				reply = lambda resp, request_id=request_id: send(request_id, resp)
+				resp = self.handle_request(data, reply)
+				if resp is not None:
+					send(request_id, resp)
 		except Exception as e:
 			logging.error(f"Client error {addr}: {e}")
 		finally:
 			sock.close()
 
-	def update_loop(self):
-		logging.info("Update loop started")
-		while self.running:
-			try:
-				with self.lock:
-					self.game_logic.update()
-				time.sleep(0.1) 
-			except Exception as e:
-				logging.error(f"Update loop error: {e}")
-
 	def start(self):
 		s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 		s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -75,8 +490,8 @@ class GameStateServer:
 		s.listen(10)
 		logging.info(f"Game State Server running on {self.host}:{self.port}")
 		
-		update_thread = threading.Thread(target=self.update_loop, daemon=True)
-		update_thread.start()
+		self.scheduler = Scheduler()
+		threading.Thread(target=self.scheduler.run, daemon=True).start()
 		
 		while self.running:
 			try:
@@ -86,10 +501,69 @@ class GameStateServer:
 			except Exception as e:
 				logging.error(f"Accept error: {e}")
 
-if __name__ == '__main__':
-	server = GameStateServer()
+	# Mode asyncio: semua koneksi worker dilayani oleh satu event loop dan
+	# transisi room dijalankan sebagai callback terjadwal, tanpa thread tambahan.
+
+	async def handle_client_async(self, reader, writer):
+		addr = writer.get_extra_info('peername')
+		logging.info(f"Worker connected from {addr}")
+		try:
+			while self.running:
+				header = await reader.readexactly(FRAME_HEADER.size)
+				length, request_id = FRAME_HEADER.unpack(header)
+				if length > MAX_FRAME_SIZE:
+					raise ProtocolError(f"Frame too large: {length} bytes")
+				data = await reader.readexactly(length)
+				reply = lambda resp, request_id=request_id: writer.write(encode_frame(request_id, resp))
+				resp = self.handle_request(data, reply)
+				if resp is not None:
+					writer.write(encode_frame(request_id, resp))
+				await writer.drain()
+		except asyncio.IncompleteReadError:
+			pass
+		except Exception as e:
+			logging.error(f"Client error {addr}: {e}")
+		finally:
+			writer.close()
+
+	async def serve_async(self):
+		loop = asyncio.get_running_loop()
+		self.loop = loop
+		server = await asyncio.start_server(self.handle_client_async, self.host, self.port, reuse_address=True)
+		logging.info(f"Game State Server (asyncio) running on {self.host}:{self.port}")
+		async with server:
+			await server.serve_forever()
+
+	def start_async(self):
+		asyncio.run(self.serve_async())
+
+def main():
+	parser = argparse.ArgumentParser(description='Dots and Boxes Game State Server')
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=9000)
+	parser.add_argument('--mode', choices=['threaded', 'asyncio'], default='threaded',
+		help='threaded: satu thread per koneksi worker; asyncio: satu event loop untuk semua koneksi')
+	parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+		help='port endpoint GET /metrics (0 untuk mematikan)')
+	parser.add_argument('--trace-file', default=DEFAULT_TRACE_FILE,
+		help='file trace (format Chrome trace JSON), boleh sama dengan proses lain')
+	parser.add_argument('--trace-sample', type=float, default=0.0,
+		help='fraksi request yang di-trace (0 untuk mematikan)')
+	args = parser.parse_args()
+
+	TRACER.configure('game_state_server', args.trace_file, args.trace_sample)
+	TRACER.start()
+	server = GameStateServer(args.host, args.port)
+	if args.metrics_port:
+		threading.Thread(target=MetricsServer, args=(args.host, args.metrics_port), daemon=True).start()
 	try:
-		server.start()
+		if args.mode == 'asyncio':
+			server.start_async()
+		else:
+			server.start()
 	except KeyboardInterrupt:
 		logging.info("Shutting down Game State Server...")
 		server.running = False
+
+if __name__ == '__main__':
+	main()
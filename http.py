@@ -1,91 +1,199 @@
-import sys
-import os.path
-import uuid
+import re
 import json
+import math
 import time
 import threading
-from glob import glob
-from datetime import datetime
+from email.utils import formatdate
+from functools import lru_cache
+from urllib.parse import urlsplit, parse_qs
 from game_state_client import GameStateClient
+from game_protocol import OK_PREFIX, NO_SESSION, response_etag
+from request_parser import HttpRequest, RequestError, parse_request
+from static_files import StaticFiles, FileResponse, not_modified, parse_range
+from metrics import REGISTRY, CONTENT_TYPE, TimedLock
+
+LONG_POLL_MAX_SECONDS = 25
+# ID room pilihan client (/join?room=) dibatasi supaya aman dipakai di mana pun
+ROOM_ID_RE = re.compile(r'[A-Za-z0-9_-]{1,32}')
+
+SERVER_HEADER = b"Server: DotsAndBoxesServer/1.1\r\n"
+CONNECTION_HEADERS = {
+    True: b"Connection: keep-alive\r\n" + SERVER_HEADER,
+    False: b"Connection: close\r\n" + SERVER_HEADER,
+}
+
+# (detik epoch, header Date) -- diformat ulang paling sering sekali per detik
+_date_header = (0, b"")
+
+def date_header():
+    global _date_header
+    now = int(time.time())
+    cached = _date_header
+    if cached[0] != now:
+        cached = (now, "Date: {}\r\n".format(formatdate(now, usegmt=True)).encode())
+        _date_header = cached
+    return cached[1]
+
+@lru_cache(maxsize=64)
+def status_line(kode, message):
+    return "HTTP/1.1 {} {}\r\n".format(kode, message).encode()
+
+class DeferredResponse:
+    """Response yang baru siap belakangan (long-poll).
+
+    Server memanggil start(callback) lalu melepas thread-nya; callback
+    dipanggil dengan bytes response saat hasilnya tersedia.
+    """
+    def __init__(self, starter):
+        self.starter = starter
+
+    def start(self, callback):
+        self.starter(callback)
 
 class HttpServer:
-    def __init__(self):
-        self.sessions = {}
+    def __init__(self, gss_pool_size=20, serve_metrics=True):
+        self.long_polls = {}
         self.types = {}
         self.types['.pdf'] = 'application/pdf'
         self.types['.jpg'] = 'image/jpeg'
         self.types['.txt'] = 'text/plain'
         self.types['.html'] = 'text/html'
-        self.game_state_client = GameStateClient()
-        self.lock = threading.Lock()
+        self.static_files = StaticFiles('./', self.types)
+        self.game_state_client = GameStateClient(pool_size=gss_pool_size)
+        self.serve_metrics = serve_metrics
+        self.lock = TimedLock('http_server')
+        # Data per request (mis. keep-alive) untuk thread yang sedang memproses
+        self.context = threading.local()
         
         if not self.game_state_client.connect():
             raise Exception("Failed to connect to Game State Server")
 
-    def response(self, kode=404, message='Not Found', messagebody=bytes(), headers={}):
-        tanggal = datetime.utcnow().strftime('%a, %d %b %Y %H:%M:%S GMT')
-        resp = []
-        resp.append("HTTP/1.1 {} {}\r\n".format(kode, message))
-        resp.append("Date: {}\r\n".format(tanggal))
-        resp.append("Connection: close\r\n")
-        resp.append("Server: DotsAndBoxesServer/1.1\r\n")
-        resp.append("Content-Length: {}\r\n".format(len(messagebody)))
-        for kk in headers:
-            resp.append("{}:{}\r\n".format(kk, headers[kk]))
-        resp.append("\r\n")
-
-        response_headers = ''
-        for i in resp:
-            response_headers = "{}{}".format(response_headers, i)
-        
-        if (type(messagebody) is not bytes):
-            messagebody = messagebody.encode()
+    def response_head(self, kode, message, content_length, headers=None, keep_alive=None):
+        """Status line dan header saja; content_length None berarti tanpa Content-Length (mis. 304)."""
+        if keep_alive is None:
+            keep_alive = getattr(self.context, 'keep_alive', False)
+        parts = [
+            status_line(kode, message),
+            date_header(),
+            CONNECTION_HEADERS[bool(keep_alive)],
+        ]
+        if content_length is not None:
+            parts.append(b"Content-Length: %d\r\n" % content_length)
+        if headers:
+            parts.append("".join("{}: {}\r\n".format(k, v) for k, v in headers.items()).encode())
+        parts.append(b"\r\n")
+        return b"".join(parts)
 
-        response = response_headers.encode() + messagebody
-        return response
+    def response(self, kode=404, message='Not Found', messagebody=b'', headers=None, keep_alive=None):
+        if type(messagebody) is not bytes:
+            messagebody = messagebody.encode()
+        # Content-Length dihitung dari bytes, bukan dari str
+        return self.response_head(kode, message, len(messagebody), headers, keep_alive) + messagebody
 
-    def proses(self, data):
-        if "\r\n\r\n" in data:
-            header_part, body_part = data.split("\r\n\r\n", 1)
+    def proses(self, data, keep_alive=False):
+        """data berupa HttpRequest dari RequestParser, atau teks/bytes request utuh."""
+        self.context.keep_alive = keep_alive
+        if isinstance(data, HttpRequest):
+            request = data
         else:
-            header_part = data
-            body_part = ""
-            
-        requests = header_part.split("\r\n")
-        baris = requests[0]
-        all_headers = [n for n in requests[1:] if n!='']
+            try:
+                request = parse_request(data)
+            except RequestError as e:
+                return self.response(e.status, e.reason, e.reason, {})
 
-        j = baris.split(" ")
-        try:
-            method=j[0].upper().strip()
-            if (method=='GET'):
-                object_address = j[1].strip()
-                return self.http_get(object_address, all_headers)
-            if (method=='POST'):
-                object_address = j[1].strip()
-                return self.http_post(object_address, all_headers, body_part)
-            else:
-                return self.response(400,'Bad Request','',{})
-        except IndexError:
-            return self.response(400,'Bad Request','',{})
-
-    def get_player_id(self, headers):
-        cookie_str = ''
-        for header in headers:
-            if header.lower().startswith('cookie:'):
-                cookie_str = header.split(':', 1)[1].strip()
-                break
-        
+        if request.method == 'GET':
+            return self.http_get(request.target, request.headers)
+        if request.method == 'POST':
+            return self.http_post(request.target, request.headers, request.body)
+        return self.response(400, 'Bad Request', '', {})
+
+    def get_session_id(self, headers):
+        # Session disimpan di game state server, jadi worker mana pun bisa
+        # melayaninya; di sini cukup membaca session_id dari cookie
+        cookie_str = headers.get('cookie', '')
         cookies = dict(item.split('=', 1) for item in cookie_str.split('; ') if '=' in item and cookie_str)
-        session_id = cookies.get('session_id')
-        
+        return cookies.get('session_id')
+
+    def is_no_session(self, raw):
+        return bool(raw) and NO_SESSION.encode() in raw
+
+    def state_headers(self):
+        # Jam server ikut dikirim supaya client bisa mengoreksi selisih jam
+        # saat menghitung sisa countdown dari countdown_deadline
+        return {'Content-Type': 'application/json', 'X-Server-Time': '{:.3f}'.format(time.time())}
+
+    def state_reply(self, raw, keep_alive=None):
+        """Response 200 untuk JSON state dari game state server, diberi ETag versinya."""
+        headers = self.state_headers()
+        etag = response_etag(raw)
+        if etag:
+            headers['ETag'] = '"{}"'.format(etag)
+            headers['Cache-Control'] = 'no-cache'
+        return self.response(200, 'OK', raw, headers, keep_alive)
+
+    def parse_etags(self, headers):
+        value = headers.get('if-none-match')
+        if not value:
+            return []
+        return [tag.strip().removeprefix('W/').strip('"') for tag in value.split(',')]
+
+    def parse_version(self, query):
+        try:
+            return int(query['since'][0])
+        except (KeyError, IndexError, ValueError):
+            return None
+
+    def parse_wait(self, query):
+        try:
+            wait = float(query['wait'][0])
+        except (KeyError, IndexError, ValueError):
+            return 0
+        # nan/inf lolos dari min/max; anggap tidak menunggu
+        if not math.isfinite(wait):
+            return 0
+        return min(max(wait, 0), LONG_POLL_MAX_SECONDS)
+
+    def long_poll(self, room_id, since, wait, keep_alive, done):
+        # Beberapa client yang menunggu versi yang sama di room yang sama
+        # cukup diwakili satu request watch ke game state server
+        key = (room_id, since)
+        with self.lock:
+            waiters = self.long_polls.get(key)
+            if waiters is not None:
+                waiters.append((keep_alive, done))
+                return
+            self.long_polls[key] = [(keep_alive, done)]
+        self.game_state_client.watch(room_id, since, wait, lambda raw: self.finish_long_poll(key, raw))
+
+    def finish_long_poll(self, key, raw, close=False):
+        # close: paksa Connection: close (worker sedang berhenti)
+        with self.lock:
+            waiters = self.long_polls.pop(key, [])
+        results = {}
+        for keep_alive, done in waiters:
+            keep_alive = keep_alive and not close
+            if keep_alive not in results:
+                if raw and raw.startswith(OK_PREFIX):
+                    results[keep_alive] = self.state_reply(raw, keep_alive)
+                else:
+                    results[keep_alive] = self.response(500, 'Internal Server Error', 'Failed to get game state', {}, keep_alive)
+            done(results[keep_alive])
+
+    def release_long_polls(self):
+        """Jawab semua long-poll yang sedang menunggu tanpa menunggu perubahan
+        state (dipakai saat worker berhenti), seperti ketika wait habis.
+        Koneksinya ditutup setelah response terkirim."""
         with self.lock:
-            if session_id and session_id in self.sessions:
-                self.sessions[session_id]['last_seen'] = time.time()
-                return self.sessions[session_id]['player_id']
-        return None
+            keys = list(self.long_polls)
+        for room_id, since in keys:
+            raw = self.game_state_client.get_delta_raw(room_id, since)
+            self.finish_long_poll((room_id, since), raw, close=True)
 
     def http_get(self, object_address, headers):
+        url = urlsplit(object_address)
+        query = parse_qs(url.query)
+        object_address = url.path
+
         if object_address == '/':
             return self.response(200, 'OK', 'Dots and Boxes Game Server', dict())
         
@@ -95,74 +203,115 @@ class HttpServer:
         if object_address == '/santai':
             return self.response(200, 'OK', 'santai saja', dict())
 
+        if object_address == '/metrics' and self.serve_metrics:
+            return self.response(200, 'OK', REGISTRY.render(), {'Content-Type': CONTENT_TYPE})
+
         if object_address == '/join':
-            with self.lock:
-                response = self.game_state_client.assign_player()
-                if response.get('status') == 'OK' and response.get('player_id'):
-                    player_id = response['player_id']
-                    new_session_id = str(uuid.uuid4())
-                    self.sessions[new_session_id] = {
-                        'player_id': player_id,
-                        'last_seen': time.time()
-                    }
-                    body = json.dumps({'status': 'OK', 'player_id': player_id})
-                    headers_resp = {
-                        'Content-Type': 'application/json',
-                        'Set-Cookie': 'session_id={}; Path=/'.format(new_session_id)
-                    }
-                    return self.response(200, 'OK', body, headers_resp)
-                else:
-                    return self.response(503, 'Service Unavailable', 'Game is full.')
+            # Room boleh dipilih lewat ?room=<id>, kalau tidak dipilihkan oleh game state server
+            room_id = query.get('room', [None])[0]
+            if room_id is not None and not ROOM_ID_RE.fullmatch(room_id):
+                return self.response(400, 'Bad Request', 'Invalid room id')
+            response = self.game_state_client.assign_player(room_id, session=True)
+            if response.get('status') == 'OK' and response.get('player_id'):
+                player_id = response['player_id']
+                room_id = response['room_id']
+                new_session_id = response['session_id']
+                body = json.dumps({'status': 'OK', 'player_id': player_id, 'room_id': room_id})
+                headers_resp = {
+                    'Content-Type': 'application/json',
+                    'Set-Cookie': 'session_id={}; Path=/'.format(new_session_id)
+                }
+                return self.response(200, 'OK', body, headers_resp)
+            else:
+                return self.response(503, 'Service Unavailable', 'Game is full.')
 
         if object_address == '/gamestate':
-            player_id = self.get_player_id(headers)
-            if player_id:
-                # Update game state sebelum mengembalikan state
-                self.game_state_client.update_game()
-                response = self.game_state_client.get_state()
-                if response.get('status') == 'OK':
-                    body = json.dumps({'status': 'OK', 'state': response['state']})
-                    return self.response(200, 'OK', body, {'Content-Type': 'application/json'})
+            session_id = self.get_session_id(headers)
+            if session_id:
+                # Transisi state dijalankan sendiri oleh game state server tepat
+                # pada deadline-nya, jadi cukup satu request untuk membaca state
+                since = self.parse_version(query)
+                wait = self.parse_wait(query)
+                if since is not None and wait:
+                    # Session diperpanjang selama request ini ditahan
+                    session = self.game_state_client.get_session(session_id, wait)
+                    if not session or session.get('status') != 'OK':
+                        return self.response(401, 'Unauthorized', 'No session')
+                    room_id = session['room_id']
+                    keep_alive = self.context.keep_alive
+                    return DeferredResponse(lambda done: self.long_poll(room_id, since, wait, keep_alive, done))
+                # Dengan If-None-Match, game state server hanya membalas penanda
+                # not_modified kalau versi room masih sama dengan ETag client
+                client_etags = self.parse_etags(headers)
+                client_etag = client_etags[0] if client_etags else None
+                if since is not None:
+                    # Client yang sudah punya state versi `since` cukup diberi perubahannya
+                    raw = self.game_state_client.session_delta_raw(session_id, since, client_etag)
                 else:
-                    return self.response(500, 'Internal Server Error', 'Failed to get game state')
+                    raw = self.game_state_client.session_state_raw(session_id, client_etag)
+                etag = response_etag(raw)
+                if etag and etag in client_etags:
+                    return self.response_head(304, 'Not Modified', None, {'ETag': '"{}"'.format(etag)})
+                # JSON dari game state server sudah di-cache per versi di sana,
+                # jadi diteruskan apa adanya tanpa decode/encode ulang
+                if raw and raw.startswith(OK_PREFIX):
+                    return self.state_reply(raw)
+                if self.is_no_session(raw):
+                    return self.response(401, 'Unauthorized', 'No session')
+                return self.response(500, 'Internal Server Error', 'Failed to get game state')
             return self.response(401, 'Unauthorized', 'No session')
 
-        files = glob('./*')
-        thedir = './'
-        object_address = object_address[1:] 
-        
-        if thedir + object_address not in files:
+        return self.serve_static(object_address, headers)
+
+    def serve_static(self, object_address, headers):
+        entry = self.static_files.find(object_address[1:])
+        if entry is None:
             return self.response(404, 'Not Found', '', {})
-        
+
+        headers_resp = {
+            'Content-Type': entry.content_type,
+            'ETag': entry.etag,
+            'Last-Modified': entry.last_modified,
+            'Accept-Ranges': 'bytes'
+        }
+        if not_modified(entry, headers):
+            return self.response_head(304, 'Not Modified', None, headers_resp)
+
+        byte_range = parse_range(headers.get('range'), entry.size)
+        if byte_range is False:
+            return self.response(416, 'Range Not Satisfiable', '', {'Content-Range': 'bytes */{}'.format(entry.size)})
+        if byte_range is None:
+            kode, message, offset, count = 200, 'OK', 0, entry.size
+        else:
+            offset, count = byte_range
+            kode, message = 206, 'Partial Content'
+            headers_resp['Content-Range'] = 'bytes {}-{}/{}'.format(offset, offset + count - 1, entry.size)
+
         try:
-            fp = open(thedir + object_address, 'rb')
-            isi = fp.read()
-            fp.close()
-            
-            fext = os.path.splitext(thedir + object_address)[1]
-            content_type = self.types.get(fext, 'application/octet-stream')
-            
-            headers_resp = {}
-            headers_resp['Content-type'] = content_type
-            
-            return self.response(200, 'OK', isi, headers_resp)
+            if self.static_files.is_small(entry):
+                isi = self.static_files.read(entry)
+                return self.response(kode, message, isi[offset:offset + count], headers_resp)
+            # File besar tidak dibaca ke memori; worker mengirimnya dengan sendfile
+            return FileResponse(self.response_head(kode, message, count, headers_resp), entry.path, offset, count)
         except IOError:
             return self.response(404, 'Not Found', '', {})
 
     def http_post(self, object_address, headers, body):
         if object_address == '/action':
-            player_id = self.get_player_id(headers)
-            if not player_id:
+            session_id = self.get_session_id(headers)
+            if not session_id:
                 return self.response(401, 'Unauthorized', 'No session')
             
             try:
                 if body.strip():
                     action_data = json.loads(body)
-                    response = self.game_state_client.process_command(player_id, action_data)
-                    if response.get('status') == 'OK':
-                        return self.response(200, 'OK', json.dumps(response), {'Content-Type': 'application/json'})
+                    raw = self.game_state_client.session_command_raw(session_id, action_data)
+                    if raw and raw.startswith(OK_PREFIX):
+                        return self.response(200, 'OK', raw, self.state_headers())
+                    elif self.is_no_session(raw):
+                        return self.response(401, 'Unauthorized', 'No session')
                     else:
-                        return self.response(500, 'Internal Server Error', json.dumps(response))
+                        return self.response(500, 'Internal Server Error', raw or json.dumps({'status': 'ERROR'}))
                 else:
                     return self.response(400, 'Bad Request', 'Empty body')
                     
@@ -175,20 +324,6 @@ class HttpServer:
         isi = "kosong"
         return self.response(200, 'OK', isi, headers_resp)
 
-    def cleanup_sessions(self):
-        with self.lock:
-            current_time = time.time()
-            stale_ids = [
-                sid for sid, data in self.sessions.items()
-                if current_time - data.get('last_seen', 0) > 5
-            ]
-            
-            for sid in stale_ids:
-                if sid in self.sessions:
-                    player_id = self.sessions.pop(sid)['player_id']
-                    self.game_state_client.player_disconnected(player_id)
-
-
 if __name__ == "__main__":
     httpserver = HttpServer()
     d = httpserver.proses('GET testing.txt HTTP/1.0')
@@ -1,15 +1,26 @@
 from socket import *
 import socket
+import os
 import time
 import sys
 import logging
 import multiprocessing
 import threading
 import itertools
+import selectors
+import errno
+import argparse
+import re
+import zlib
+import json
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
+from metrics import REGISTRY, EndpointServer, metrics_route
+from tracing import TRACER, DEFAULT_TRACE_FILE, REQUEST_ID_HEADER, new_request_id
 
 LISTEN_HOST = '0.0.0.0'
 LISTEN_PORT = 8000
+STATS_PORT = 8099
 
 BACKEND_SERVERS = [
     ('127.0.0.1', 8001),
@@ -18,33 +29,414 @@ BACKEND_SERVERS = [
 
 logging.basicConfig(level=logging.INFO, format='LB - %(levelname)s: %(message)s')
 
+UPSTREAM_REQUESTS = REGISTRY.counter('lb_upstream_requests_total', 'Request mode http per worker dan status response', ('backend', 'status'))
+UPSTREAM_DURATION = REGISTRY.histogram('lb_upstream_request_duration_seconds', 'Latensi request mode http ke worker (tanpa long-poll)', ('backend',))
+
+PROXY_BUFFER_LIMIT = 256 * 1024
+PROXY_RECV_SIZE = 65536
+BACKEND_CONNECT_TIMEOUT = 10.0
+SPLICE_CHUNK_SIZE = 65536
+# os.splice hanya ada di Linux (Python 3.10+); selain itu pakai recv/sendall
+SPLICE_AVAILABLE = hasattr(os, 'splice')
+# Batas tabel affinity (IP / session_id -> worker)
+AFFINITY_MAX_ENTRIES = 10000
+AFFINITY_TTL_SECONDS = 600
+# Routing cookie: batas header request yang diintip sebelum memilih worker
+MAX_PEEK_BYTES = 8192
+SNIFF_TAIL_BYTES = 256
+# Health check aktif ke tiap worker
+HEALTH_CHECK_PATH = '/santai'
+HEALTH_CHECK_INTERVAL = 2.0
+HEALTH_CHECK_TIMEOUT = 1.0
+HEALTH_FALL = 2
+HEALTH_RISE = 2
+EWMA_ALPHA = 0.3
+# Mode http: koneksi upstream keep-alive dipakai ulang antar request.
+# Batas idle harus di bawah KEEP_ALIVE_TIMEOUT worker (15 detik).
+UPSTREAM_IDLE_TIMEOUT = 10.0
+UPSTREAM_MAX_IDLE = 32
+# Cukup untuk long-poll /gamestate (maksimal 25 detik di worker)
+UPSTREAM_READ_TIMEOUT = 40.0
+CLIENT_IDLE_TIMEOUT = 60.0
+SESSION_COOKIE_RE = re.compile(rb'^cookie:[^\r\n]*?\bsession_id=([^;\s]+)', re.IGNORECASE | re.MULTILINE)
+SET_COOKIE_RE = re.compile(rb'\r\nset-cookie:\s*session_id=([^;\s]+)[;\r]', re.IGNORECASE)
+REQUEST_ID_RE = re.compile(rb'\r\nx-request-id:[ \t]*([\x21-\x7e]{1,64})', re.IGNORECASE)
+
+class AffinityTable:
+    """Peta kunci (IP atau session_id) -> worker dengan batas jumlah entri
+    (LRU) dan TTL sejak terakhir dipakai. Dipanggil di bawah lock balancer."""
+    def __init__(self, max_entries=AFFINITY_MAX_ENTRIES, ttl=AFFINITY_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        backend, last_used = entry
+        now = time.monotonic()
+        if now - last_used > self.ttl:
+            del self.entries[key]
+            return None
+        self.entries[key] = (backend, now)
+        self.entries.move_to_end(key)
+        return backend
+
+    def set(self, key, backend):
+        now = time.monotonic()
+        self.entries[key] = (backend, now)
+        self.entries.move_to_end(key)
+        while self.entries:
+            oldest_key, (_, last_used) = next(iter(self.entries.items()))
+            if len(self.entries) <= self.max_entries and now - last_used <= self.ttl:
+                break
+            del self.entries[oldest_key]
+
+    def discard(self, key, backend):
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == backend:
+            del self.entries[key]
+
+    def __len__(self):
+        return len(self.entries)
+
+def add_request_id(head, end):
+    """Pastikan request membawa header X-Request-ID. Mengembalikan (head, ID).
+    `end` adalah posisi akhir header terakhir (awal \r\n\r\n penutup, atau
+    len(head) jika penutupnya sudah dibuang); header baru disisipkan di sana."""
+    match = REQUEST_ID_RE.search(head, 0, end)
+    if match:
+        return head, match.group(1).decode('latin-1')
+    request_id = new_request_id()
+    line = b'\r\n' + REQUEST_ID_HEADER.encode() + b': ' + request_id.encode()
+    return head[:end] + line + head[end:], request_id
+
+def parse_session_cookie(head):
+    match = SESSION_COOKIE_RE.search(head)
+    return match.group(1).decode('latin-1') if match else None
+
+class SessionSniffer:
+    """Mencari Set-Cookie session_id di aliran response worker supaya koneksi
+    lain dengan cookie yang sama diarahkan ke worker yang sama."""
+    def __init__(self, balancer, backend):
+        self.balancer = balancer
+        self.backend = backend
+        self.tail = b''
+
+    def feed(self, data):
+        window = self.tail + data
+        match = SET_COOKIE_RE.search(window)
+        if match:
+            self.balancer.learn_session(match.group(1).decode('latin-1'), self.backend)
+            return True
+        self.tail = window[-SNIFF_TAIL_BYTES:]
+        return False
+
+class UpstreamPool:
+    """Koneksi keep-alive ke satu worker yang siap dipakai ulang (LIFO)."""
+    def __init__(self, addr):
+        self.addr = addr
+        self.idle = []
+        self.lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def checkout(self):
+        """Mengembalikan (socket, reused). reused=True berarti koneksi lama
+        yang mungkin sudah ditutup worker, jadi request idempoten boleh diulang sekali."""
+        now = time.monotonic()
+        while True:
+            sock = None
+            with self.lock:
+                while self.idle:
+                    candidate, last_used = self.idle.pop()
+                    if now - last_used < UPSTREAM_IDLE_TIMEOUT:
+                        sock = candidate
+                        break
+                    safe_close_socket(candidate)
+            if sock is None:
+                break
+            if self.is_alive(sock):
+                with self.lock:
+                    self.reused += 1
+                return sock, True
+            safe_close_socket(sock)
+        sock = socket.create_connection(self.addr, timeout=BACKEND_CONNECT_TIMEOUT)
+        with self.lock:
+            self.created += 1
+        return sock, False
+
+    def is_alive(self, sock):
+        # Koneksi idle seharusnya tidak punya data masuk; EOF, error, atau
+        # byte tak terduga berarti koneksi tidak bisa dipakai lagi
+        try:
+            sock.settimeout(0)
+            sock.recv(1, socket.MSG_PEEK)
+            return False
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+    def checkin(self, sock):
+        with self.lock:
+            if len(self.idle) < UPSTREAM_MAX_IDLE:
+                self.idle.append((sock, time.monotonic()))
+                return
+        safe_close_socket(sock)
+
+    def stats(self):
+        with self.lock:
+            return {'idle': len(self.idle), 'created': self.created, 'reused': self.reused}
+
+class Backend:
+    """Status satu worker: sehat/tidak, koneksi yang sedang berjalan, latensi
+    (EWMA dari health check dan waktu connect) dan jumlah error."""
+    def __init__(self, addr):
+        self.addr = addr
+        self.healthy = True
+        self.in_flight = 0
+        self.total = 0
+        self.errors = 0
+        self.latency_ewma = None
+        self.fails = 0
+        self.passes = 0
+        self.pool = UpstreamPool(addr)
+
+    def observe_latency(self, seconds):
+        if self.latency_ewma is None:
+            self.latency_ewma = seconds
+        else:
+            self.latency_ewma += EWMA_ALPHA * (seconds - self.latency_ewma)
+
+    def cost(self):
+        # Peak-EWMA: latensi dikali antrean supaya worker lambat dapat lebih sedikit
+        return (self.latency_ewma or 0.0) * (self.in_flight + 1)
+
+    def stats(self):
+        return {
+            'backend': f"{self.addr[0]}:{self.addr[1]}",
+            'healthy': self.healthy,
+            'in_flight': self.in_flight,
+            'total': self.total,
+            'errors': self.errors,
+            'latency_ms': round(self.latency_ewma * 1000, 2) if self.latency_ewma is not None else None,
+            'upstream_pool': self.pool.stats()
+        }
+
 class StickyLoadBalancer:
-    def __init__(self):
-        self.ip_to_backend = {}
+    def __init__(self, mode='threaded', loops=1, use_splice=SPLICE_AVAILABLE, routing='ip', policy='round_robin'):
+        # mode 'threaded': satu thread handler + dua thread forward per koneksi
+        # mode 'selector': semua koneksi dimultipleks oleh `loops` event loop
+        # mode 'http': request diteruskan satu per satu lewat pool koneksi upstream
+        # routing 'ip': sticky per IP client; 'cookie': sticky per session_id
+        # policy untuk client baru: 'round_robin', 'least_outstanding', 'ewma'
+        self.mode = mode
+        self.loops = loops
+        self.use_splice = use_splice and SPLICE_AVAILABLE
+        self.routing = routing
+        self.policy = policy
+        self.backends = {addr: Backend(addr) for addr in BACKEND_SERVERS}
+        self.ip_to_backend = AffinityTable()
+        self.session_to_backend = AffinityTable()
         self.backend_cycler = itertools.cycle(BACKEND_SERVERS)
         self.lock = threading.Lock()
+        REGISTRY.gauge('lb_backend_healthy', 'Status health check worker (1 sehat)', ('backend',),
+            fn=lambda: self.backend_metric(lambda b: int(b.healthy)))
+        REGISTRY.gauge('lb_backend_in_flight', 'Koneksi/request yang sedang berjalan ke worker', ('backend',),
+            fn=lambda: self.backend_metric(lambda b: b.in_flight))
+        REGISTRY.gauge('lb_backend_connections', 'Total koneksi/request yang diarahkan ke worker', ('backend',),
+            fn=lambda: self.backend_metric(lambda b: b.total))
+        REGISTRY.gauge('lb_backend_errors', 'Total kegagalan koneksi ke worker', ('backend',),
+            fn=lambda: self.backend_metric(lambda b: b.errors))
+        REGISTRY.gauge('lb_backend_latency_ewma_seconds', 'EWMA latensi worker', ('backend',),
+            fn=lambda: self.backend_metric(lambda b: b.latency_ewma))
+        REGISTRY.gauge('lb_affinity_entries', 'Entri tabel affinity', ('table',),
+            fn=lambda: {('ip',): len(self.ip_to_backend), ('session',): len(self.session_to_backend)})
+
+    def forget_backend(self, client_ip, backend, session_id=None):
+        with self.lock:
+            self.backends[backend].errors += 1
+            self.ip_to_backend.discard(client_ip, backend)
+            if session_id:
+                self.session_to_backend.discard(session_id, backend)
 
-    def select_backend(self, client_ip):
+    def learn_session(self, session_id, backend):
         with self.lock:
-            if client_ip not in self.ip_to_backend:
-                backend = next(self.backend_cycler)
-                self.ip_to_backend[client_ip] = backend
+            self.session_to_backend.set(session_id, backend)
+        logging.info(f"Session {session_id[:8]} terikat ke worker {backend}")
+
+    def choose_backend_locked(self):
+        healthy = [b for b in self.backends.values() if b.healthy]
+        # Kalau semua worker dianggap mati tetap coba salah satunya
+        candidates = healthy or list(self.backends.values())
+        # Mulai dari posisi round robin berikutnya supaya worker yang seri
+        # tetap mendapat giliran bergantian
+        start = BACKEND_SERVERS.index(next(self.backend_cycler))
+        ordered = [self.backends[addr] for addr in BACKEND_SERVERS[start:] + BACKEND_SERVERS[:start]]
+        ordered = [b for b in ordered if b in candidates]
+        if self.policy == 'least_outstanding':
+            return min(ordered, key=lambda b: b.in_flight).addr
+        if self.policy == 'ewma':
+            return min(ordered, key=lambda b: b.cost()).addr
+        return ordered[0].addr
+
+    def is_usable_locked(self, backend):
+        return self.backends[backend].healthy or not any(b.healthy for b in self.backends.values())
+
+    def select_backend(self, client_ip, session_id=None):
+        with self.lock:
+            if self.routing == 'cookie':
+                if session_id:
+                    backend = self.session_to_backend.get(session_id)
+                    if backend is None:
+                        # Session tak dikenal (mis. balancer baru restart): hash
+                        # supaya semua koneksinya tetap ke worker yang sama
+                        backend = BACKEND_SERVERS[zlib.crc32(session_id.encode()) % len(BACKEND_SERVERS)]
+                    if not self.is_usable_locked(backend):
+                        backend = self.choose_backend_locked()
+                    self.session_to_backend.set(session_id, backend)
+                    return backend
+                # Kontak pertama tanpa cookie dibagi rata, tidak per IP, supaya
+                # pemain di balik NAT yang sama tidak menumpuk di satu worker
+                backend = self.choose_backend_locked()
+                logging.info(f"Client baru {client_ip} tanpa session, diarahkan ke worker {backend}")
+                return backend
+            backend = self.ip_to_backend.get(client_ip)
+            if backend is None or not self.is_usable_locked(backend):
+                backend = self.choose_backend_locked()
+                self.ip_to_backend.set(client_ip, backend)
                 logging.info(f"Client baru {client_ip}, diarahkan ke worker {backend}")
-            return self.ip_to_backend[client_ip]
+            return backend
+
+    def connection_started(self, backend):
+        with self.lock:
+            state = self.backends[backend]
+            state.in_flight += 1
+            state.total += 1
 
-def forward_data(source, destination, direction="", client_ip="", backend_info=""):
+    def connection_finished(self, backend, latency=None):
+        with self.lock:
+            state = self.backends[backend]
+            state.in_flight -= 1
+            if latency is not None:
+                state.observe_latency(latency)
+
+    def report_health(self, backend, latency):
+        with self.lock:
+            state = self.backends[backend]
+            if latency is None:
+                state.passes = 0
+                state.fails += 1
+                if state.healthy and state.fails >= HEALTH_FALL:
+                    state.healthy = False
+                    logging.warning(f"Worker {backend} tidak sehat, dikeluarkan dari rotasi")
+                return
+            state.fails = 0
+            state.passes += 1
+            state.observe_latency(latency)
+            if not state.healthy and state.passes >= HEALTH_RISE:
+                state.healthy = True
+                logging.info(f"Worker {backend} sehat kembali, dimasukkan ke rotasi")
+
+    def backend_metric(self, value):
+        with self.lock:
+            return {(f"{b.addr[0]}:{b.addr[1]}",): value(b) for b in self.backends.values()}
+
+    def stats(self):
+        with self.lock:
+            return {
+                'mode': self.mode,
+                'routing': self.routing,
+                'policy': self.policy,
+                'backends': [b.stats() for b in self.backends.values()],
+                'affinity': {'ip': len(self.ip_to_backend), 'session': len(self.session_to_backend)}
+            }
+
+class HealthChecker:
+    """Thread yang berkala mengirim GET HEALTH_CHECK_PATH ke tiap worker.
+    Worker dikeluarkan setelah HEALTH_FALL kegagalan berturut-turut dan
+    dimasukkan lagi setelah HEALTH_RISE keberhasilan berturut-turut."""
+    def __init__(self, balancer, interval=HEALTH_CHECK_INTERVAL):
+        self.balancer = balancer
+        self.interval = interval
+
+    def probe(self, backend):
+        started = time.monotonic()
+        try:
+            with socket.create_connection(backend, timeout=HEALTH_CHECK_TIMEOUT) as sock:
+                sock.sendall(f"GET {HEALTH_CHECK_PATH} HTTP/1.1\r\nHost: lb\r\nConnection: close\r\n\r\n".encode())
+                status_line = b''
+                while b'\r\n' not in status_line:
+                    chunk = sock.recv(1024)
+                    if not chunk:
+                        break
+                    status_line += chunk
+        except OSError:
+            return None
+        parts = status_line.split(b' ', 2)
+        if len(parts) < 2 or parts[1] != b'200':
+            return None
+        return time.monotonic() - started
+
+    def run(self):
+        while True:
+            for backend in BACKEND_SERVERS:
+                self.balancer.report_health(backend, self.probe(backend))
+            time.sleep(self.interval)
+
+def StatsServer(balancer, port=STATS_PORT):
+    """Endpoint read-only GET /stats berisi status tiap worker (JSON) dan
+    GET /metrics dalam format teks Prometheus."""
+    logging.info(f"Statistik load balancer tersedia di http://{LISTEN_HOST}:{port}/stats")
+    stats = lambda: ('application/json', json.dumps(balancer.stats(), indent=2).encode())
+    EndpointServer(LISTEN_HOST, port, {b'/': stats, b'/stats': stats, b'/metrics': metrics_route()})
+
+def forward_buffered(source, destination, counters, direction, until=None):
+    """Mengembalikan True saat EOF, False jika berhenti karena until(data) bernilai benar."""
+    while True:
+        data = source.recv(PROXY_RECV_SIZE)
+        if not data:
+            return True
+        destination.sendall(data)
+        counters[direction] += len(data)
+        if until is not None and until(data):
+            return False
+
+def forward_splice(source, destination, counters, direction):
+    # Data dipindah socket -> pipe -> socket di dalam kernel tanpa disalin
+    # ke memori Python
+    pipe_r, pipe_w = os.pipe()
     try:
+        src_fd, dst_fd = source.fileno(), destination.fileno()
         while True:
-            data = source.recv(4096)
-            if not data:
-                break
-            
-            if direction == "client->backend" and data.strip():
-                logging.info(f"Client {client_ip} REQUEST ke worker {backend_info}")
-            elif direction == "backend->client" and data.strip():
-                logging.info(f"Client {client_ip} RESPONSE dari worker {backend_info}")
-            
-            destination.sendall(data)
+            n = os.splice(src_fd, pipe_w, SPLICE_CHUNK_SIZE)
+            if n == 0:
+                return
+            while n:
+                sent = os.splice(pipe_r, dst_fd, n)
+                counters[direction] += sent
+                n -= sent
+    finally:
+        os.close(pipe_r)
+        os.close(pipe_w)
+
+def forward_data(source, destination, direction, counters, use_splice=False, sniffer=None):
+    """Teruskan data satu arah sampai EOF. Jumlah byte dicatat di counters[direction]."""
+    counters.setdefault(direction, 0)
+    try:
+        eof = False
+        if sniffer is not None:
+            # Data harus terlihat sampai Set-Cookie ditemukan; setelah itu
+            # boleh pindah ke jalur splice
+            eof = forward_buffered(source, destination, counters, direction, sniffer.feed)
+        if eof:
+            pass
+        elif use_splice:
+            forward_splice(source, destination, counters, direction)
+        else:
+            forward_buffered(source, destination, counters, direction)
     except (ConnectionResetError, BrokenPipeError, OSError):
         pass
     except Exception as e:
@@ -53,6 +445,165 @@ def forward_data(source, destination, direction="", client_ip="", backend_info="
         safe_close_socket(source)
         safe_close_socket(destination)
 
+IDEMPOTENT_METHODS = (b'GET', b'HEAD', b'OPTIONS')
+
+def read_http_message(sock, buf):
+    """Baca satu pesan HTTP (header + body sepanjang Content-Length).
+    Mengembalikan (head, body, sisa byte) atau None jika EOF sebelum ada data."""
+    while b'\r\n\r\n' not in buf:
+        if len(buf) > MAX_PEEK_BYTES:
+            raise ValueError("Header HTTP terlalu besar")
+        chunk = sock.recv(PROXY_RECV_SIZE)
+        if not chunk:
+            if buf:
+                raise ConnectionError("Koneksi terputus di tengah header")
+            return None
+        buf += chunk
+    head, rest = buf.split(b'\r\n\r\n', 1)
+    length = 0
+    for line in head.split(b'\r\n')[1:]:
+        if line[:15].lower() == b'content-length:':
+            length = int(line[15:].strip())
+            break
+    while len(rest) < length:
+        chunk = sock.recv(PROXY_RECV_SIZE)
+        if not chunk:
+            raise ConnectionError("Koneksi terputus di tengah body")
+        rest += chunk
+    return head, rest[:length], rest[length:]
+
+def message_keep_alive(head):
+    lines = head.split(b'\r\n')
+    http10 = b'HTTP/1.0' in lines[0]
+    connection = b''
+    for line in lines[1:]:
+        if line[:11].lower() == b'connection:':
+            connection = line[11:].strip().lower()
+            break
+    if http10:
+        return connection == b'keep-alive'
+    return connection != b'close'
+
+def set_connection_header(head, keep_alive):
+    lines = [line for line in head.split(b'\r\n') if line[:11].lower() != b'connection:']
+    lines.append(b'Connection: keep-alive' if keep_alive else b'Connection: close')
+    return b'\r\n'.join(lines)
+
+def proxy_request(balancer, client_ip, session_id, head, body, request_id=None):
+    """Teruskan satu request lewat pool upstream worker terpilih.
+    Mengembalikan (head, body) response atau None jika worker gagal."""
+    backend = balancer.select_backend(client_ip, session_id)
+    label = f"{backend[0]}:{backend[1]}"
+    pool = balancer.backends[backend].pool
+    request = set_connection_header(head, True) + b'\r\n\r\n' + body
+    # Long-poll sengaja lama, jangan ikut dihitung sebagai latensi worker
+    long_poll = b'wait=' in head.split(b'\r\n', 1)[0]
+    # Hanya request yang aman diulang yang dikirim ulang saat koneksi lama gagal
+    idempotent = head.split(b' ', 1)[0] in IDEMPOTENT_METHODS
+    started = time.monotonic()
+    latency = None
+    # Tetap 502 kalau worker gagal menjawab
+    status = '502'
+    balancer.connection_started(backend)
+    try:
+        for _ in range(2):
+            try:
+                sock, reused = pool.checkout()
+            except OSError as e:
+                logging.error(f"Error connecting to worker {backend[0]}:{backend[1]} - {e}")
+                balancer.forget_backend(client_ip, backend, session_id)
+                return None
+            try:
+                sock.settimeout(UPSTREAM_READ_TIMEOUT)
+                sock.sendall(request)
+                first = sock.recv(PROXY_RECV_SIZE)
+            except socket.timeout:
+                logging.error(f"Timeout menunggu response worker {backend[0]}:{backend[1]}")
+                safe_close_socket(sock)
+                balancer.forget_backend(client_ip, backend, session_id)
+                return None
+            except OSError:
+                first = b''
+            if not first:
+                safe_close_socket(sock)
+                if reused and idempotent:
+                    # Tidak ada satu byte pun response: koneksi idle sudah
+                    # ditutup worker, ulangi dengan koneksi baru
+                    continue
+                balancer.forget_backend(client_ip, backend, session_id)
+                return None
+            try:
+                message = read_http_message(sock, first)
+            except (OSError, ValueError) as e:
+                # Response terpotong: request sudah diproses worker, jangan diulang
+                logging.error(f"Response worker {backend[0]}:{backend[1]} tidak lengkap: {e}")
+                safe_close_socket(sock)
+                balancer.forget_backend(client_ip, backend, session_id)
+                return None
+            resp_head, resp_body, rest = message
+            if message_keep_alive(resp_head) and not rest:
+                pool.checkin(sock)
+            else:
+                safe_close_socket(sock)
+            if balancer.routing == 'cookie' and session_id is None:
+                match = SET_COOKIE_RE.search(resp_head + b'\r\n')
+                if match:
+                    balancer.learn_session(match.group(1).decode('latin-1'), backend)
+            if not long_poll:
+                latency = time.monotonic() - started
+                UPSTREAM_DURATION.observe(latency, label)
+            status = resp_head[9:12].decode('latin-1')
+            return resp_head, resp_body
+        return None
+    finally:
+        UPSTREAM_REQUESTS.inc(label, status)
+        TRACER.span('lb.upstream', request_id, started, {'backend': label, 'status': status})
+        balancer.connection_finished(backend, latency)
+
+def handle_client_http(client_socket, client_address, balancer, accepted=None):
+    """Mode http: request client diurai satu per satu dan tiap request
+    dirutekan sendiri ke worker lewat koneksi upstream yang dipakai ulang."""
+    client_ip = client_address[0]
+    handler_started = time.monotonic()
+    buf = b''
+    try:
+        client_socket.settimeout(CLIENT_IDLE_TIMEOUT)
+        while True:
+            message = read_http_message(client_socket, buf)
+            if message is None:
+                return
+            head, body, buf = message
+            started = time.monotonic()
+            request_id = None
+            if TRACER.enabled:
+                head, request_id = add_request_id(head, len(head))
+                if accepted is not None:
+                    # Jeda dari accept sampai thread handler mulai berjalan
+                    TRACER.span('lb.thread_start', request_id, accepted, ended=handler_started)
+                    accepted = None
+            keep_alive = message_keep_alive(head)
+            response = proxy_request(balancer, client_ip, parse_session_cookie(head), head, body, request_id)
+            if response is None:
+                client_socket.sendall(b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                TRACER.span('lb.request', request_id, started, {'status': '502'})
+                return
+            resp_head, resp_body = response
+            client_socket.sendall(set_connection_header(resp_head, keep_alive) + b'\r\n\r\n' + resp_body)
+            TRACER.span('lb.request', request_id, started, {'status': resp_head[9:12].decode('latin-1')})
+            if not keep_alive:
+                return
+    except (OSError, ValueError):
+        pass
+    except Exception as e:
+        logging.error(f"Error memproses client {client_ip}: {e}")
+    finally:
+        safe_close_socket(client_socket)
+
+def log_connection_bytes(client_ip, backend_info, sent_up, sent_down, started):
+    logging.info(f"Client {client_ip} <-> worker {backend_info} selesai: "
+                 f"{sent_up} byte request, {sent_down} byte response, "
+                 f"{time.monotonic() - started:.1f} detik")
+
 def safe_close_socket(sock):
     try:
         sock.shutdown(socket.SHUT_RDWR)
@@ -63,28 +614,73 @@ def safe_close_socket(sock):
     except OSError:
         pass
 
-def handle_client(client_socket, client_address, balancer):
+def peek_request_head(sock):
+    """Baca sampai akhir header request pertama (atau MAX_PEEK_BYTES)."""
+    data = b''
+    while b'\r\n\r\n' not in data and len(data) < MAX_PEEK_BYTES:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+def handle_client(client_socket, client_address, balancer, accepted=None):
     client_ip = client_address[0]
-    backend_host, backend_port = balancer.select_backend(client_ip)
+    head = b''
+    session_id = None
+    sniffer = None
+    # Header request pertama dibaca lebih dulu untuk routing cookie dan,
+    # apa pun routing-nya, untuk memberi ID request saat tracing aktif
+    if balancer.routing == 'cookie' or TRACER.enabled:
+        try:
+            client_socket.settimeout(10.0)
+            head = peek_request_head(client_socket)
+        except OSError:
+            safe_close_socket(client_socket)
+            return
+        if not head:
+            safe_close_socket(client_socket)
+            return
+        if balancer.routing == 'cookie':
+            session_id = parse_session_cookie(head)
+    request_id = None
+    header_end = head.find(b'\r\n\r\n')
+    if TRACER.enabled and header_end >= 0:
+        # Hanya request pertama yang terbaca di sini; request berikutnya di
+        # koneksi yang sama diberi ID oleh worker. Header yang terpotong di
+        # MAX_PEEK_BYTES diteruskan apa adanya.
+        head, request_id = add_request_id(head, header_end)
+    backend_host, backend_port = balancer.select_backend(client_ip, session_id)
     backend_info = f"{backend_host}:{backend_port}"
     backend_socket = None
+    counters = {"client->backend": len(head)}
+    started = time.monotonic()
+    connect_time = None
+    balancer.connection_started((backend_host, backend_port))
+    if balancer.routing == 'cookie' and session_id is None:
+        sniffer = SessionSniffer(balancer, (backend_host, backend_port))
 
     try:
         backend_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         backend_socket.settimeout(10.0)
         backend_socket.connect((backend_host, backend_port))
+        connect_time = time.monotonic() - started
+        TRACER.span('lb.connect', request_id, accepted if accepted is not None else started,
+                    {'backend': backend_info})
 
         client_socket.settimeout(None)
         backend_socket.settimeout(None)
+        if head:
+            backend_socket.sendall(head)
 
         client_to_backend = threading.Thread(
             target=forward_data, 
-            args=(client_socket, backend_socket, "client->backend", client_ip, backend_info), 
+            args=(client_socket, backend_socket, "client->backend", counters, balancer.use_splice), 
             daemon=True
         )
         backend_to_client = threading.Thread(
             target=forward_data, 
-            args=(backend_socket, client_socket, "backend->client", client_ip, backend_info), 
+            args=(backend_socket, client_socket, "backend->client", counters, balancer.use_splice, sniffer), 
             daemon=True
         )
         
@@ -93,49 +689,328 @@ def handle_client(client_socket, client_address, balancer):
         
         client_to_backend.join()
         backend_to_client.join()
+        log_connection_bytes(client_ip, backend_info, counters.get("client->backend", 0),
+                             counters.get("backend->client", 0), started)
 
     except socket.timeout:
         logging.error(f"Timeout connecting to worker {backend_info}")
+        balancer.forget_backend(client_ip, (backend_host, backend_port), session_id)
     except ConnectionRefusedError:
         logging.error(f"Worker {backend_info} is not available")
-        with balancer.lock:
-            if balancer.ip_to_backend.get(client_ip) == (backend_host, backend_port):
-                del balancer.ip_to_backend[client_ip]
+        balancer.forget_backend(client_ip, (backend_host, backend_port), session_id)
     except Exception as e:
         logging.error(f"Error connecting to worker {backend_info} - {e}")
-        with balancer.lock:
-            if balancer.ip_to_backend.get(client_ip) == (backend_host, backend_port):
-                del balancer.ip_to_backend[client_ip]
+        balancer.forget_backend(client_ip, (backend_host, backend_port), session_id)
     finally:
+        balancer.connection_finished((backend_host, backend_port), connect_time)
         safe_close_socket(client_socket)
         if backend_socket:
             safe_close_socket(backend_socket)
 
-def Server():
+class ProxyPair:
+    """Sepasang socket client <-> backend beserta buffer tiap arah."""
+    def __init__(self, client_sock, client_ip):
+        self.client = client_sock
+        self.client_ip = client_ip
+        self.backend_addr = None
+        self.backend = None
+        self.session_id = None
+        self.sniffer = None
+        # peeking: header request pertama belum lengkap (routing cookie atau
+        # tracing aktif)
+        self.peeking = False
+        self.request_id = None
+        self.accepted = None
+        self.connecting = True
+        self.connect_started = time.monotonic()
+        self.to_backend = bytearray()
+        self.to_client = bytearray()
+        self.client_eof = False
+        self.backend_eof = False
+        self.backend_shut = False
+        self.client_shut = False
+        self.sent_up = 0
+        self.sent_down = 0
+        self.connect_time = None
+
+class ProxyLoop:
+    """Satu event loop berbasis selectors yang meneruskan data banyak pasangan
+    socket secara non-blocking. Sisi yang buffer tujuannya penuh berhenti
+    dibaca sampai buffer itu terkuras (backpressure)."""
+    def __init__(self, balancer):
+        self.balancer = balancer
+        self.selector = selectors.DefaultSelector()
+        self.pending = []
+        self.pairs = set()
+        self.lock = threading.Lock()
+        self.wakeup_r, self.wakeup_w = socket.socketpair()
+        self.wakeup_r.setblocking(False)
+        self.wakeup_w.setblocking(False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ, None)
+
+    def add_client(self, client_sock, client_address, accepted=None):
+        with self.lock:
+            self.pending.append((client_sock, client_address, accepted))
+        try:
+            self.wakeup_w.send(b'\0')
+        except OSError:
+            pass
+
+    def start_pair(self, client_sock, client_address, accepted=None):
+        pair = ProxyPair(client_sock, client_address[0])
+        pair.accepted = accepted
+        try:
+            client_sock.setblocking(False)
+        except OSError:
+            safe_close_socket(client_sock)
+            return
+        self.pairs.add(pair)
+        if self.balancer.routing == 'cookie' or TRACER.enabled:
+            pair.peeking = True
+            self.update_interest(pair)
+        else:
+            self.connect_backend(pair)
+
+    def connect_backend(self, pair):
+        if pair.peeking:
+            pair.peeking = False
+            if self.balancer.routing == 'cookie':
+                pair.session_id = parse_session_cookie(pair.to_backend)
+            header_end = pair.to_backend.find(b'\r\n\r\n')
+            if TRACER.enabled and header_end >= 0:
+                # Sama seperti mode threaded: hanya request pertama
+                pair.to_backend, pair.request_id = add_request_id(pair.to_backend, header_end)
+        backend = self.balancer.select_backend(pair.client_ip, pair.session_id)
+        pair.backend_addr = backend
+        pair.connect_started = time.monotonic()
+        self.balancer.connection_started(backend)
+        if self.balancer.routing == 'cookie' and pair.session_id is None:
+            pair.sniffer = SessionSniffer(self.balancer, backend)
+        try:
+            pair.backend = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            pair.backend.setblocking(False)
+            err = pair.backend.connect_ex(backend)
+            if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                raise OSError(err, os.strerror(err))
+        except OSError as e:
+            logging.error(f"Error connecting to worker {backend[0]}:{backend[1]} - {e}")
+            self.balancer.forget_backend(pair.client_ip, backend, pair.session_id)
+            self.close_pair(pair)
+            return
+        self.update_interest(pair)
+
+    def update_interest(self, pair):
+        if pair.peeking:
+            self.set_events(pair.client, selectors.EVENT_READ, pair)
+            return
+        client_events = 0
+        if not pair.client_eof and not pair.connecting and len(pair.to_backend) < PROXY_BUFFER_LIMIT:
+            client_events |= selectors.EVENT_READ
+        if pair.to_client:
+            client_events |= selectors.EVENT_WRITE
+        backend_events = 0
+        if pair.connecting or pair.to_backend:
+            backend_events |= selectors.EVENT_WRITE
+        if not pair.connecting and not pair.backend_eof and len(pair.to_client) < PROXY_BUFFER_LIMIT:
+            backend_events |= selectors.EVENT_READ
+        self.set_events(pair.client, client_events, pair)
+        self.set_events(pair.backend, backend_events, pair)
+
+    def set_events(self, sock, events, pair):
+        try:
+            key = self.selector.get_key(sock)
+        except KeyError:
+            key = None
+        if events == 0:
+            if key is not None:
+                self.selector.unregister(sock)
+        elif key is None:
+            self.selector.register(sock, events, pair)
+        elif key.events != events:
+            self.selector.modify(sock, events, pair)
+
+    def close_pair(self, pair):
+        if pair in self.pairs and pair.backend_addr is not None:
+            log_connection_bytes(pair.client_ip, f"{pair.backend_addr[0]}:{pair.backend_addr[1]}",
+                                 pair.sent_up, pair.sent_down, pair.connect_started)
+            self.balancer.connection_finished(pair.backend_addr, pair.connect_time)
+        self.pairs.discard(pair)
+        for sock in (pair.client, pair.backend):
+            if sock is None:
+                continue
+            try:
+                self.selector.unregister(sock)
+            except (KeyError, ValueError):
+                pass
+            safe_close_socket(sock)
+
+    def handle_event(self, pair, sock, mask):
+        if pair.peeking:
+            data = sock.recv(PROXY_RECV_SIZE)
+            if not data:
+                self.close_pair(pair)
+                return
+            pair.to_backend += data
+            if b'\r\n\r\n' in pair.to_backend or len(pair.to_backend) >= MAX_PEEK_BYTES:
+                self.connect_backend(pair)
+            return
+
+        if sock is pair.backend and pair.connecting:
+            err = pair.backend.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                logging.error(f"Worker {pair.backend_addr[0]}:{pair.backend_addr[1]} is not available")
+                self.balancer.forget_backend(pair.client_ip, pair.backend_addr, pair.session_id)
+                self.close_pair(pair)
+                return
+            pair.connecting = False
+            pair.connect_time = time.monotonic() - pair.connect_started
+            TRACER.span('lb.connect', pair.request_id,
+                        pair.accepted if pair.accepted is not None else pair.connect_started,
+                        {'backend': f"{pair.backend_addr[0]}:{pair.backend_addr[1]}"})
+
+        if mask & selectors.EVENT_READ:
+            if sock is pair.client:
+                data = sock.recv(PROXY_RECV_SIZE)
+                if data:
+                    pair.to_backend += data
+                else:
+                    pair.client_eof = True
+            else:
+                data = sock.recv(PROXY_RECV_SIZE)
+                if data:
+                    pair.to_client += data
+                    if pair.sniffer is not None and pair.sniffer.feed(data):
+                        pair.sniffer = None
+                else:
+                    pair.backend_eof = True
+
+        if mask & selectors.EVENT_WRITE:
+            if sock is pair.client and pair.to_client:
+                sent = sock.send(pair.to_client)
+                del pair.to_client[:sent]
+                pair.sent_down += sent
+            elif sock is pair.backend and pair.to_backend:
+                sent = sock.send(pair.to_backend)
+                del pair.to_backend[:sent]
+                pair.sent_up += sent
+
+        # Teruskan EOF setelah buffer arah tersebut terkirim semua
+        if pair.client_eof and not pair.to_backend and not pair.backend_shut and not pair.connecting:
+            pair.backend_shut = True
+            try:
+                pair.backend.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+        if pair.backend_eof and not pair.to_client and not pair.client_shut:
+            pair.client_shut = True
+            try:
+                pair.client.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+        # Worker menutup koneksinya dan semua response sudah diteruskan
+        if pair.client_shut:
+            self.close_pair(pair)
+            return
+        self.update_interest(pair)
+
+    def run(self):
+        while True:
+            for key, mask in self.selector.select(timeout=1.0):
+                if key.data is None:
+                    try:
+                        while self.wakeup_r.recv(4096):
+                            pass
+                    except OSError:
+                        pass
+                    continue
+                pair = key.data
+                if pair not in self.pairs:
+                    continue
+                try:
+                    self.handle_event(pair, key.fileobj, mask)
+                except (BlockingIOError, InterruptedError):
+                    pass
+                except OSError:
+                    self.close_pair(pair)
+                except Exception as e:
+                    logging.error(f"Error saat meneruskan data client {pair.client_ip}: {e}")
+                    self.close_pair(pair)
+
+            with self.lock:
+                pending, self.pending = self.pending, []
+            for client_sock, client_address, accepted in pending:
+                self.start_pair(client_sock, client_address, accepted)
+
+            now = time.monotonic()
+            for pair in list(self.pairs):
+                if pair.peeking and now - pair.connect_started > BACKEND_CONNECT_TIMEOUT:
+                    self.close_pair(pair)
+                elif pair.connecting and now - pair.connect_started > BACKEND_CONNECT_TIMEOUT:
+                    logging.error(f"Timeout connecting to worker {pair.backend_addr[0]}:{pair.backend_addr[1]}")
+                    self.balancer.forget_backend(pair.client_ip, pair.backend_addr, pair.session_id)
+                    self.close_pair(pair)
+
+def Server(mode='threaded', loops=1, use_splice=SPLICE_AVAILABLE, routing='ip', policy='round_robin', stats_port=STATS_PORT):
     the_clients = []
     my_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     my_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    balancer = StickyLoadBalancer()
+    balancer = StickyLoadBalancer(mode, loops, use_splice, routing, policy)
 
     my_socket.bind((LISTEN_HOST, LISTEN_PORT))
     my_socket.listen(10)
     logging.info(f"Load Balancer (Sticky Session) berjalan di {LISTEN_HOST}:{LISTEN_PORT}")
-    logging.info(f"Meneruskan ke workers: {BACKEND_SERVERS}")
+    logging.info(f"Meneruskan ke workers: {BACKEND_SERVERS} (routing {balancer.routing}, policy {balancer.policy})")
+
+    threading.Thread(target=HealthChecker(balancer).run, daemon=True).start()
+    if stats_port:
+        threading.Thread(target=StatsServer, args=(balancer, stats_port), daemon=True).start()
+
+    proxy_loops = []
+    if balancer.mode == 'selector':
+        logging.info(f"Mode selector dengan {balancer.loops} event loop")
+        for _ in range(balancer.loops):
+            proxy_loop = ProxyLoop(balancer)
+            threading.Thread(target=proxy_loop.run, daemon=True).start()
+            proxy_loops.append(proxy_loop)
+    next_loop = itertools.cycle(proxy_loops)
 
     while True:
         try:
             connection, client_address = my_socket.accept()
+            if proxy_loops:
+                next(next_loop).add_client(connection, client_address, time.monotonic())
+                continue
             threading.Thread(
-                target=handle_client, 
-                args=(connection, client_address, balancer), 
+                target=handle_client_http if balancer.mode == 'http' else handle_client, 
+                args=(connection, client_address, balancer, time.monotonic()), 
                 daemon=True
             ).start()
         except Exception as e:
             logging.error(f"Error accepting client connection: {e}")
 
 def main():
+    parser = argparse.ArgumentParser(description='Sticky load balancer Dots and Boxes')
+    parser.add_argument('--mode', choices=['threaded', 'selector', 'http'], default='threaded',
+        help='threaded: thread per koneksi; selector: koneksi dimultipleks oleh event loop; '
+             'http: tiap request dirutekan lewat koneksi upstream yang dipakai ulang')
+    parser.add_argument('--loops', type=int, default=1, help='jumlah event loop untuk mode selector')
+    parser.add_argument('--no-splice', action='store_true',
+        help='mode threaded: jangan pakai os.splice walaupun tersedia')
+    parser.add_argument('--routing', choices=['ip', 'cookie'], default='ip',
+        help='ip: sticky per IP client; cookie: sticky per cookie session_id')
+    parser.add_argument('--policy', choices=['round_robin', 'least_outstanding', 'ewma'], default='round_robin',
+        help='cara memilih worker untuk client baru')
+    parser.add_argument('--stats-port', type=int, default=STATS_PORT,
+        help='port endpoint GET /stats (0 untuk mematikan)')
+    parser.add_argument('--trace-file', default=DEFAULT_TRACE_FILE,
+        help='file trace (format Chrome trace JSON), boleh sama dengan proses lain')
+    parser.add_argument('--trace-sample', type=float, default=0.0,
+        help='fraksi request yang di-trace (0 untuk mematikan); ID request dibuat di sini')
+    args = parser.parse_args()
+    TRACER.configure('load_balancer', args.trace_file, args.trace_sample)
+    TRACER.start()
     try:
-        Server()
+        Server(args.mode, max(1, args.loops), not args.no_splice, args.routing, args.policy, args.stats_port)
     except KeyboardInterrupt:
         logging.info("Shutting down Load Balancer...")
     except Exception as e:
@@ -0,0 +1,227 @@
+import time
+import socket
+import bisect
+import logging
+import threading
+
+# Batas bucket histogram latensi (detik)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = ('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Penghitung yang hanya bertambah, per kombinasi nilai label."""
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        for labelvalues, value in sorted(items):
+            yield self.name, format_labels(self.labelnames, labelvalues), value
+
+class Gauge:
+    """Nilai yang bisa naik turun. Dengan `fn`, nilai dibaca saat render:
+    fn() mengembalikan angka, atau dict {tuple nilai label: angka}."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), fn=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def set(self, value, *labelvalues):
+        with self.lock:
+            self.values[labelvalues] = value
+
+    def samples(self):
+        if self.fn is not None:
+            try:
+                result = self.fn()
+            except Exception as e:
+                logging.error(f"Gagal membaca gauge {self.name}: {e}")
+                return
+            items = result.items() if isinstance(result, dict) else [((), result)]
+        else:
+            with self.lock:
+                items = list(self.values.items())
+        for labelvalues, value in sorted(items):
+            if value is not None:
+                yield self.name, format_labels(self.labelnames, labelvalues), value
+
+class Histogram:
+    """Histogram bucket tetap per kombinasi nilai label. observe() hanya
+    mencari bucket dengan bisect dan menambah satu hitungan; akumulasi
+    bucket (le) dihitung saat render."""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # nilai label -> [hitungan per bucket (+Inf di akhir), jumlah, total]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labelvalues)
+            if entry is None:
+                entry = self.values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self.lock:
+            items = [(labelvalues, list(entry[0]), entry[1], entry[2]) for labelvalues, entry in self.values.items()]
+        for labelvalues, counts, total, count in sorted(items):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                yield self.name + '_bucket', format_labels(self.labelnames, labelvalues, ('le', format_value(float(bound)))), cumulative
+            yield self.name + '_sum', format_labels(self.labelnames, labelvalues), total
+            yield self.name + '_count', format_labels(self.labelnames, labelvalues), count
+
+class Registry:
+    """Kumpulan metrik satu proses, dirender dalam format teks Prometheus."""
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=(), fn=None):
+        gauge = self.register(Gauge(name, help, labelnames, fn))
+        if fn is not None:
+            # Objek pemilik fn bisa dibuat ulang (mis. Server di proses anak)
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append('{}{} {}'.format(name, labels, format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+LOCK_WAIT = REGISTRY.histogram('lock_wait_seconds', 'Waktu menunggu lock', ('lock',),
+    buckets=(0.00001, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0))
+
+class TimedLock:
+    """Pembungkus threading.Lock yang mencatat waktu tunggu acquire ke
+    LOCK_WAIT. Percobaan pertama tanpa blocking supaya lock yang bebas
+    tidak perlu membaca jam sama sekali."""
+    def __init__(self, name, lock=None):
+        self.name = name
+        self.lock = lock or threading.Lock()
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self.lock.acquire(False):
+            LOCK_WAIT.observe(0.0, self.name)
+            return True
+        if not blocking:
+            return False
+        started = time.monotonic()
+        acquired = self.lock.acquire(True, timeout)
+        LOCK_WAIT.observe(time.monotonic() - started, self.name)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+def EndpointServer(host, port, routes):
+    """Server HTTP kecil untuk endpoint read-only (satu request per koneksi).
+    routes: {path bytes: fungsi tanpa argumen -> (content type, body bytes)}."""
+    endpoint_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    endpoint_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    endpoint_socket.bind((host, port))
+    endpoint_socket.listen(5)
+    while True:
+        try:
+            connection, _ = endpoint_socket.accept()
+        except OSError:
+            continue
+        try:
+            connection.settimeout(2.0)
+            request = connection.recv(4096).split(b'\r\n', 1)[0].split(b' ')
+            path = request[1].split(b'?', 1)[0] if len(request) > 1 else b''
+            handler = routes.get(path) if request[0] == b'GET' else None
+            if handler is not None:
+                status = '200 OK'
+                content_type, body = handler()
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain', b'Not Found'
+            connection.sendall(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                               f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        except Exception as e:
+            logging.error(f"Error melayani endpoint di port {port}: {e}")
+        finally:
+            connection.close()
+
+def metrics_route(registry=REGISTRY):
+    return lambda: (CONTENT_TYPE, registry.render().encode())
+
+def MetricsServer(host, port, registry=REGISTRY):
+    """Endpoint GET /metrics untuk proses yang tidak melayani HTTP sendiri."""
+    logging.info(f"Metrik tersedia di http://{host}:{port}/metrics")
+    EndpointServer(host, port, {b'/metrics': metrics_route(registry)})
@@ -0,0 +1,132 @@
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+RECV_SIZE = 16 * 1024
+
+class RequestError(Exception):
+    """Request tidak valid; status dan reason dipakai untuk response error."""
+    def __init__(self, status, reason):
+        super().__init__("{} {}".format(status, reason))
+        self.status = status
+        self.reason = reason
+
+class HttpRequest:
+    """Satu request HTTP yang sudah diurai. Nama header disimpan huruf kecil."""
+    __slots__ = ('method', 'target', 'version', 'headers', 'body', 'head')
+
+    def __init__(self, method, target, version, headers, body=b'', head=b''):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+        self.body = body
+        self.head = head
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    @property
+    def content_length(self):
+        value = self.headers.get('content-length')
+        if value is None:
+            return 0
+        try:
+            length = int(value)
+        except ValueError:
+            raise RequestError(400, 'Bad Request')
+        if length < 0:
+            raise RequestError(400, 'Bad Request')
+        return length
+
+def parse_head(head):
+    """Urai request line dan header (tanpa \\r\\n\\r\\n penutup)."""
+    text = bytes(head).decode('latin-1')
+    lines = text.split('\r\n')
+    parts = lines[0].split(' ')
+    if len(parts) < 2 or not parts[0] or not parts[1]:
+        raise RequestError(400, 'Bad Request')
+    version = parts[2].upper() if len(parts) > 2 else 'HTTP/1.0'
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(':')
+        if not sep:
+            raise RequestError(400, 'Bad Request')
+        headers[name.strip().lower()] = value.strip()
+    return HttpRequest(parts[0].upper(), parts[1], version, headers, b'', text)
+
+def parse_request(data):
+    """Urai satu request lengkap dari bytes/str sekaligus (mis. untuk pengujian)."""
+    if isinstance(data, str):
+        data = data.encode('latin-1', 'replace')
+    head, sep, body = data.partition(b'\r\n\r\n')
+    request = parse_head(head.rstrip(b'\r\n') if not sep else head)
+    request.body = body
+    return request
+
+class RequestParser:
+    """Parser request HTTP inkremental di atas satu bytearray per koneksi.
+
+    Akhir header dicari sekali saja (pencarian dilanjutkan dari posisi terakhir),
+    header diurai sekali, lalu body diambil sebagai bytes setelah Content-Length
+    byte tersedia. Sisa buffer adalah request pipelined berikutnya.
+    """
+    def __init__(self, max_header_bytes=MAX_HEADER_BYTES, max_body_bytes=MAX_BODY_BYTES):
+        self.max_header_bytes = max_header_bytes
+        self.max_body_bytes = max_body_bytes
+        self.buffer = bytearray()
+        self.scratch = None
+        self.scanned = 0
+        self.pending = None
+        self.body_start = 0
+        self.body_length = 0
+
+    def feed(self, data):
+        self.buffer += data
+
+    def read_from(self, sock):
+        """Terima data dari socket langsung ke buffer. Mengembalikan jumlah byte (0 saat EOF)."""
+        if self.scratch is None:
+            self.scratch = bytearray(RECV_SIZE)
+        n = sock.recv_into(self.scratch)
+        if n:
+            with memoryview(self.scratch) as view:
+                self.buffer += view[:n]
+        return n
+
+    def has_buffered(self):
+        return len(self.buffer) > 0
+
+    def next_request(self):
+        """Request lengkap berikutnya, atau None jika datanya belum cukup."""
+        if self.pending is None:
+            # Mundur 3 byte supaya \r\n\r\n yang terpotong antar recv tetap ketemu
+            end = self.buffer.find(b'\r\n\r\n', max(0, self.scanned - 3))
+            if end < 0:
+                self.scanned = len(self.buffer)
+                if self.scanned > self.max_header_bytes:
+                    raise RequestError(431, 'Request Header Fields Too Large')
+                return None
+            if end > self.max_header_bytes:
+                raise RequestError(431, 'Request Header Fields Too Large')
+            request = parse_head(self.buffer[:end])
+            length = request.content_length
+            if length > self.max_body_bytes:
+                raise RequestError(413, 'Payload Too Large')
+            self.pending = request
+            self.body_start = end + 4
+            self.body_length = length
+
+        request_end = self.body_start + self.body_length
+        if len(self.buffer) < request_end:
+            return None
+        request = self.pending
+        request.body = bytes(self.buffer[self.body_start:request_end])
+        del self.buffer[:request_end]
+        self.pending = None
+        self.scanned = 0
+        return request
@@ -5,105 +5,536 @@ import sys
 import logging
 import multiprocessing
 import threading
-from concurrent.futures import ThreadPoolExecutor
-from http import HttpServer
+import selectors
+import os
+import signal
+import argparse
+from collections import deque
+from http import HttpServer, DeferredResponse
+from request_parser import RequestParser, RequestError
+from static_files import FileResponse
+from access_log import AccessLogger, LEVELS
+from metrics import REGISTRY, MetricsServer
+from tracing import TRACER, DEFAULT_TRACE_FILE, new_request_id, set_request_id
 
-httpserver = HttpServer()
+# Dibuat oleh Server(); pada mode pre-fork setiap proses anak membuat
+# HttpServer (dan koneksi ke game state server) miliknya sendiri
+httpserver = None
+# Di-set saat SIGTERM supaya Server berhenti menerima koneksi baru
+stop_event = threading.Event()
+access_log = AccessLogger()
 logging.basicConfig(level=logging.INFO, format='SERVER - %(levelname)s: %(message)s')
 
-def ProcessTheClient(connection, address):
-    try:
-        rcv_bytes = b""
-        while True:
-            chunk = connection.recv(4096)
-            if not chunk:
-                break
-            rcv_bytes += chunk
-            if b"GET" in rcv_bytes and rcv_bytes.endswith(b"\r\n\r\n"):
-                break
-            if b"POST" in rcv_bytes and b"\r\n\r\n" in rcv_bytes:
-                header_end = rcv_bytes.find(b"\r\n\r\n")
-                header_str = rcv_bytes[:header_end].decode()
-                content_length = 0
-                for line in header_str.split("\r\n"):
-                    if line.lower().startswith("content-length:"):
-                        content_length = int(line.split(":")[1].strip())
-                        break
-                
-                body_received = len(rcv_bytes) - (header_end + 4)
-                if body_received >= content_length:
-                    break
-        
-        if not rcv_bytes:
-            return
+KEEP_ALIVE_TIMEOUT = 15
+MAX_REQUESTS_PER_CONNECTION = 100
+REQUEST_READ_TIMEOUT = 10
+# Batas waktu proses anak berhenti sendiri sebelum dipaksa dengan SIGKILL
+SHUTDOWN_GRACE_SECONDS = 10
+# Lama maksimal menunggu response long-poll yang masih tertunda saat berhenti
+SHUTDOWN_DRAIN_SECONDS = SHUTDOWN_GRACE_SECONDS - 2
+# Anak yang mati lebih cepat dari ini setelah start di-restart dengan jeda
+MIN_CHILD_UPTIME = 1.0
+DEFAULT_THREADS = 20
+# Jumlah koneksi yang boleh menunggu thread; di atas itu langsung dijawab 503
+DEFAULT_QUEUE_DEPTH = 100
+# Ruang tambahan di antrean khusus request /action
+ACTION_QUEUE_RESERVE = 20
+RETRY_AFTER_SECONDS = 1
+# Mode pre-fork: proses anak ke-i melayani /metrics di port worker + offset + i
+METRICS_PORT_OFFSET = 1100
+PRIORITY_ACTION = 0
+PRIORITY_POLL = 1
+# Path selain ini dicatat sebagai route 'static' supaya label metrik terbatas
+ROUTES = ('/', '/join', '/gamestate', '/action', '/santai', '/metrics')
+
+REQUESTS = REGISTRY.counter('http_requests_total', 'Request HTTP yang sudah dijawab', ('route', 'status'))
+REQUEST_DURATION = REGISTRY.histogram('http_request_duration_seconds', 'Waktu proses request HTTP sampai response terkirim', ('route',))
+SHED = REGISTRY.counter('http_shed_total', 'Koneksi yang ditolak 503 karena antrean penuh')
+
+class ClientConnection:
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        # Byte yang sudah diterima tapi belum diproses (request pipelined)
+        self.parser = RequestParser()
+        self.requests_served = 0
+        self.last_active = time.monotonic()
+        # Waktu koneksi dimasukkan ke antrean WorkerPool (untuk span trace)
+        self.dispatched = None
 
-        rcv_str = rcv_bytes.decode('utf-8', 'ignore')
-        print("="*30)
-        print(f"REQUEST DARI {address}:")
-        print(rcv_str.strip())
-        print("="*30)
-        
-        hasil = httpserver.proses(rcv_str)
-        
+    def close(self):
         try:
-            header_part, body_part = hasil.split(b'\r\n\r\n', 1)
-            print(f"RESPONSE KE {address}:")
-            print(header_part.decode().strip())
-            print(f"[Body: {len(body_part)} bytes]")
-            print("-"*30 + "\n")
-        except Exception:
-            print(f"RESPONSE KE {address}:\n{hasil.decode().strip()}")
-            print("-"*30 + "\n")
+            self.sock.close()
+        except OSError:
+            pass
 
-        connection.sendall(hasil)
+class KeepAliveWatcher:
+    """Menunggu request berikutnya (di koneksi baru maupun keep-alive) tanpa
+    memakai thread pool.
 
-    except Exception as e:
-        logging.error(f"Error memproses klien {address}: {e}")
-    finally:
-        connection.close()
+    Koneksi yang sedang idle didaftarkan ke selector; begitu ada data masuk
+    koneksi dikembalikan ke pool, dan koneksi yang idle lebih lama dari
+    KEEP_ALIVE_TIMEOUT ditutup.
+    """
+    def __init__(self, dispatch):
+        self.dispatch = dispatch
+        self.selector = selectors.DefaultSelector()
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wakeup_r, self.wakeup_w = socket.socketpair()
+        self.wakeup_r.setblocking(False)
+        self.wakeup_w.setblocking(False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ, None)
+        self.stopping = False
+
+    def watch(self, client):
+        client.last_active = time.monotonic()
+        with self.lock:
+            if self.stopping:
+                # Server sedang berhenti: response sudah terkirim, tutup saja
+                client.close()
+                return
+            self.pending.append(client)
+        self.wakeup()
+
+    def wakeup(self):
+        try:
+            self.wakeup_w.send(b'\0')
+        except OSError:
+            pass
+
+    def stop(self):
+        """Tutup semua koneksi idle dan hentikan run()."""
+        with self.lock:
+            self.stopping = True
+        self.wakeup()
+
+    def close_all(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for client in pending:
+            client.close()
+        for key in list(self.selector.get_map().values()):
+            if key.data is not None:
+                self.selector.unregister(key.data.sock)
+                key.data.close()
+
+    def run(self):
+        while not self.stopping:
+            for key, _ in self.selector.select(timeout=1.0):
+                if key.data is None:
+                    try:
+                        while self.wakeup_r.recv(4096):
+                            pass
+                    except OSError:
+                        pass
+                    continue
+                client = key.data
+                self.selector.unregister(client.sock)
+                self.dispatch(client)
+
+            with self.lock:
+                pending, self.pending = self.pending, []
+            for client in pending:
+                try:
+                    self.selector.register(client.sock, selectors.EVENT_READ, client)
+                except (ValueError, OSError):
+                    client.close()
+
+            now = time.monotonic()
+            for key in list(self.selector.get_map().values()):
+                client = key.data
+                if client is not None and now - client.last_active > KEEP_ALIVE_TIMEOUT:
+                    self.selector.unregister(client.sock)
+                    client.close()
+        self.close_all()
+
+class WorkerPool:
+    """Thread pool dengan antrean terbatas dan dua tingkat prioritas.
+
+    Task PRIORITY_ACTION selalu diambil lebih dulu daripada PRIORITY_POLL.
+    submit() mengembalikan False jika antrean sudah penuh sehingga pemanggil
+    bisa langsung menolak koneksi. Tidak ada future yang disimpan; hasil
+    task tidak dipakai.
+    """
+    def __init__(self, threads=DEFAULT_THREADS, max_queue=DEFAULT_QUEUE_DEPTH):
+        self.max_queue = max_queue
+        self.queues = (deque(), deque())
+        self.cond = threading.Condition()
+        self.stopping = False
+        self.threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(threads)]
+        for thread in self.threads:
+            thread.start()
 
-def purge_stale_sessions_thread():
+    def depth(self):
+        return len(self.queues[PRIORITY_ACTION]) + len(self.queues[PRIORITY_POLL])
+
+    def submit(self, fn, *args, priority=PRIORITY_POLL, required=False):
+        """Masukkan task ke antrean. required=True untuk kelanjutan request yang
+        sudah diterima (mis. long-poll selesai), yang tidak boleh ditolak."""
+        with self.cond:
+            if not required:
+                limit = self.max_queue
+                if priority == PRIORITY_ACTION:
+                    limit += ACTION_QUEUE_RESERVE
+                if self.stopping or self.depth() >= limit:
+                    return False
+            self.queues[priority].append((fn, args))
+            self.cond.notify()
+            return True
+
+    def worker(self):
+        while True:
+            with self.cond:
+                while not self.queues[PRIORITY_ACTION] and not self.queues[PRIORITY_POLL]:
+                    if self.stopping:
+                        return
+                    self.cond.wait()
+                fn, args = (self.queues[PRIORITY_ACTION] or self.queues[PRIORITY_POLL]).popleft()
+            try:
+                fn(*args)
+            except Exception as e:
+                logging.error(f"Error di thread pool: {e}")
+
+    def shutdown(self):
+        """Tolak task baru, selesaikan yang sudah ada di antrean, lalu tunggu thread berhenti."""
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+class RunningCounter:
+    """Penghitung task yang sedang berjalan, tanpa menyimpan future."""
+    def __init__(self):
+        self.value = 0
+        self.cond = threading.Condition()
+
+    def increment(self):
+        with self.cond:
+            self.value += 1
+
+    def decrement(self):
+        with self.cond:
+            self.value -= 1
+            if self.value == 0:
+                self.cond.notify_all()
+
+    def wait_zero(self, timeout):
+        """Tunggu sampai nilainya 0. Mengembalikan False jika timeout habis."""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.value == 0, timeout)
+
+running_tasks = RunningCounter()
+# Response long-poll (DeferredResponse) yang belum terkirim
+pending_deferred = RunningCounter()
+REGISTRY.gauge('worker_running_tasks', 'Task ProcessTheClient yang sedang berjalan', fn=lambda: running_tasks.value)
+
+def route_label(request):
+    if request is None:
+        return '-'
+    path, _, query = request.target.partition('?')
+    if path == '/gamestate' and 'wait=' in query:
+        # Long-poll dipisah supaya waktu tunggunya tidak bercampur dengan poll biasa
+        return '/gamestate?wait'
+    return path if path in ROUTES else 'static'
+
+def record(address, request, response_head, size, started):
+    """Catat request yang sudah dijawab ke log akses dan metrik."""
+    duration = time.monotonic() - started
+    route = route_label(request)
+    status = response_head[9:12].decode('latin-1')
+    REQUESTS.inc(route, status)
+    REQUEST_DURATION.observe(duration, route)
+    access_log.log(address, request, response_head, size, duration)
+    if request is not None:
+        TRACER.span('worker.request', request.headers.get('x-request-id'), started, {'route': route, 'status': status})
+
+def read_request(client):
+    """Ambil satu request lengkap (HttpRequest) dari koneksi. Sisa byte (request
+    pipelined berikutnya) tetap disimpan di parser. Mengembalikan None saat EOF."""
     while True:
-        time.sleep(2)
+        request = client.parser.next_request()
+        if request is not None:
+            return request
+        if not client.parser.read_from(client.sock):
+            return None
+
+def request_priority(client):
+    """PRIORITY_ACTION jika request berikutnya di koneksi ini adalah POST /action.
+    Diintip dari buffer parser atau dengan MSG_PEEK tanpa mengonsumsi data."""
+    if client.parser.has_buffered():
+        head = bytes(client.parser.buffer[:12])
+    else:
         try:
-            httpserver.cleanup_sessions()
+            head = client.sock.recv(12, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+        except OSError:
+            head = b''
+    return PRIORITY_ACTION if head.startswith(b'POST /action') else PRIORITY_POLL
+
+def shed(client):
+    """Tolak koneksi dengan 503 secepatnya saat antrean penuh."""
+    hasil = httpserver.response(503, 'Service Unavailable', 'Server sedang sibuk, coba lagi.',
+        {'Retry-After': str(RETRY_AFTER_SECONDS)}, False)
+    try:
+        client.sock.setblocking(False)
+        # Buang request yang sudah masuk supaya close() tidak mengirim RST
+        # sebelum client sempat membaca response 503
+        try:
+            client.sock.recv(65536)
+        except OSError:
+            pass
+        client.sock.send(hasil)
+        client.sock.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+    SHED.inc()
+    access_log.log(client.address, None, hasil, len(hasil), 0)
+    client.close()
+
+def dispatch(pool, watcher, client):
+    client.dispatched = time.monotonic()
+    if not pool.submit(ProcessTheClient, client, pool, watcher, priority=request_priority(client)):
+        shed(client)
+
+def finish_deferred(client, request, started, hasil, keep_alive, pool, watcher):
+    try:
+        try:
+            client.sock.sendall(hasil)
+            record(client.address, request, hasil[:512], len(hasil), started)
         except Exception as e:
-            logging.error(f"Error cleaning up sessions: {e}")
+            logging.error(f"Error memproses klien {client.address}: {e}")
+            client.close()
+            return
+        if not keep_alive or stop_event.is_set():
+            # Watcher sudah berhenti saat worker dimatikan
+            client.close()
+        elif client.parser.has_buffered():
+            ProcessTheClient(client, pool, watcher)
+        else:
+            watcher.watch(client)
+    finally:
+        pending_deferred.decrement()
+
+def ProcessTheClient(client, pool, watcher):
+    address = client.address
+    handed_off = False
+    running_tasks.increment()
+    task_started = time.monotonic()
+    try:
+        client.sock.settimeout(REQUEST_READ_TIMEOUT)
+        while True:
+            try:
+                request = read_request(client)
+            except RequestError as e:
+                hasil = httpserver.response(e.status, e.reason, e.reason, {}, False)
+                client.sock.sendall(hasil)
+                record(address, None, hasil, len(hasil), time.monotonic())
+                return
+            if request is None:
+                return
+
+            started = time.monotonic()
+            client.requests_served += 1
+            keep_alive = (request.keep_alive and client.requests_served < MAX_REQUESTS_PER_CONNECTION
+                          and not stop_event.is_set())
+
+            if TRACER.enabled:
+                # ID dari load balancer dipakai terus; kalau tidak ada, worker membuatnya
+                request_id = request.headers.setdefault('x-request-id', new_request_id())
+                if client.dispatched is not None:
+                    TRACER.span('worker.queue', request_id, client.dispatched, ended=task_started)
+                    client.dispatched = None
+                set_request_id(request_id)
+
+            try:
+                hasil = httpserver.proses(request, keep_alive)
+            finally:
+                set_request_id(None)
+
+            if isinstance(hasil, DeferredResponse):
+                # Long-poll: thread ini dilepas, response dikirim oleh task baru
+                # di pool begitu hasilnya tersedia. Request pipelined di
+                # belakangnya tetap menunggu di parser supaya urutan terjaga.
+                handed_off = True
+                pending_deferred.increment()
+                hasil.start(lambda data: pool.submit(finish_deferred, client, request, started, data, keep_alive, pool, watcher,
+                    priority=PRIORITY_ACTION, required=True))
+                return
+
+            if isinstance(hasil, FileResponse):
+                hasil.send(client.sock)
+                record(address, request, hasil.head, len(hasil.head) + hasil.count, started)
+            else:
+                client.sock.sendall(hasil)
+                record(address, request, hasil[:512], len(hasil), started)
 
-def Server(port=8001):
-    the_clients = []
+            if not keep_alive:
+                return
+            if not client.parser.has_buffered():
+                # Tunggu request berikutnya tanpa menahan thread pool
+                handed_off = True
+                watcher.watch(client)
+                return
+
+    except socket.timeout:
+        pass
+    except Exception as e:
+        logging.error(f"Error memproses klien {address}: {e}")
+    finally:
+        running_tasks.decrement()
+        if not handed_off:
+            client.close()
+
+def Server(port=8001, reuse_port=False, threads=DEFAULT_THREADS, queue_depth=DEFAULT_QUEUE_DEPTH, metrics_port=None):
+    global httpserver
     my_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     my_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    logging.info(f"Worker Server berjalan di port {port}")
+    if reuse_port:
+        # Beberapa proses bind ke port yang sama, kernel membagi koneksi masuk
+        my_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    logging.info(f"Worker Server berjalan di port {port} (pid {os.getpid()})")
+    # Tanpa port metrik sendiri (mode satu proses), /metrics dilayani di port worker.
+    # Pada mode pre-fork port itu dibagi semua anak, jadi tiap anak memakai portnya
+    # sendiri supaya counter dari satu scrape ke scrape berikutnya tidak berganti proses
+    httpserver = HttpServer(gss_pool_size=threads, serve_metrics=metrics_port is None)
+    if metrics_port:
+        threading.Thread(target=MetricsServer, args=('0.0.0.0', metrics_port), daemon=True).start()
     logging.info("Terhubung ke Game State Server")
+    access_log.start()
+    TRACER.configure(process_name='worker:{}'.format(port))
+    TRACER.start()
     my_socket.bind(('0.0.0.0', port))
     my_socket.listen(10)
+    # accept diberi timeout supaya stop_event diperiksa secara berkala
+    my_socket.settimeout(1.0)
 
+    pool = WorkerPool(threads, queue_depth)
+    REGISTRY.gauge('worker_queue_depth', 'Task yang menunggu thread di WorkerPool', ('priority',),
+        fn=lambda: {('action',): len(pool.queues[PRIORITY_ACTION]), ('poll',): len(pool.queues[PRIORITY_POLL])})
+    REGISTRY.gauge('worker_queue_limit', 'Batas antrean WorkerPool sebelum request ditolak', fn=lambda: pool.max_queue)
+    REGISTRY.gauge('gss_pool_connections', 'Koneksi pool ke game state server', ('state',),
+        fn=lambda: {(key,): value for key, value in httpserver.game_state_client.pool_stats().items() if key in ('in_use', 'idle', 'size')})
+    watcher = KeepAliveWatcher(lambda client: dispatch(pool, watcher, client))
+    threading.Thread(target=watcher.run, daemon=True).start()
+    while not stop_event.is_set():
+        try:
+            connection, client_address = my_socket.accept()
+            connection.settimeout(None)
+            # Koneksi baru juga menunggu di watcher sampai request-nya masuk,
+            # sehingga prioritasnya bisa dibaca dan koneksi yang diam tidak
+            # memakai thread pool
+            watcher.watch(ClientConnection(connection, client_address))
+        except socket.timeout:
+            continue
+        except Exception as e:
+            logging.error(f"Error menerima koneksi: {e}")
+    my_socket.close()
+    logging.info(f"Worker pid {os.getpid()} berhenti, menunggu request yang sedang berjalan")
+    watcher.stop()
+    # Long-poll yang masih menunggu dijawab sekarang dengan state terkini,
+    # lalu tunggu response-nya terkirim sebelum thread pool dihentikan
+    httpserver.release_long_polls()
+    if not pending_deferred.wait_zero(SHUTDOWN_DRAIN_SECONDS):
+        logging.warning(f"{pending_deferred.value} response long-poll belum terkirim saat berhenti")
+    pool.shutdown()
 
-    threading.Thread(target=purge_stale_sessions_thread, daemon=True).start()
+def run_child(port, metrics_port, server_options):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    try:
+        Server(port, reuse_port=True, metrics_port=metrics_port, **server_options)
+    except Exception as e:
+        logging.error(f"Worker pid {os.getpid()} gagal: {e}")
+        os._exit(1)
+    os._exit(0)
 
-    with ThreadPoolExecutor(20) as executor:
-        while True:
+def Supervisor(port, workers, metrics_port=None, **server_options):
+    """Mode pre-fork: jalankan `workers` proses anak yang berbagi satu port
+    lewat SO_REUSEPORT, restart anak yang mati, dan hentikan semuanya dengan
+    rapi saat menerima SIGTERM/SIGINT. Anak ke-i melayani /metrics di
+    metrics_port + i; anak pengganti memakai nomor (dan port) yang sama."""
+    if metrics_port is None:
+        metrics_port = port + METRICS_PORT_OFFSET
+    children = {}
+    stopping = threading.Event()
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            run_child(port, metrics_port + index, server_options)
+        children[pid] = (time.monotonic(), index)
+        logging.info(f"Proses worker {pid} dijalankan (metrik di port {metrics_port + index})")
+
+    def request_stop(signum, frame):
+        stopping.set()
+        for pid in list(children):
             try:
-                connection, client_address = my_socket.accept()
-                p = executor.submit(ProcessTheClient, connection, client_address)
-                the_clients.append(p)
-                
-                #menampilkan jumlah process yang sedang aktif
-                jumlah = ['x' for i in the_clients if i.running()==True]
-                print(len(jumlah))
-                
-            except Exception as e:
-                logging.error(f"Error menerima koneksi: {e}")
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    logging.info(f"Supervisor pid {os.getpid()} menjalankan {workers} proses worker di port {port}")
+    for index in range(workers):
+        spawn(index)
+
+    stop_deadline = None
+    while children:
+        if stopping.is_set() and stop_deadline is None:
+            stop_deadline = time.monotonic() + SHUTDOWN_GRACE_SECONDS
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            if stop_deadline is not None and time.monotonic() > stop_deadline:
+                for child in list(children):
+                    logging.warning(f"Proses worker {child} tidak berhenti, dipaksa berhenti")
+                    try:
+                        os.kill(child, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                stop_deadline = float('inf')
+            time.sleep(0.2)
+            continue
+        child = children.pop(pid, None)
+        if child is None or stopping.is_set():
+            continue
+        started, index = child
+        logging.warning(f"Proses worker {pid} berhenti (status {os.waitstatus_to_exitcode(status)}), dijalankan ulang")
+        if time.monotonic() - started < MIN_CHILD_UPTIME:
+            time.sleep(MIN_CHILD_UPTIME)
+        spawn(index)
+    logging.info("Semua proses worker sudah berhenti")
 
 def main():
+    parser = argparse.ArgumentParser(description='Worker HTTP Dots and Boxes')
+    parser.add_argument('port', nargs='?', type=int, default=8001)
+    parser.add_argument('--workers', type=int, default=1,
+        help='jumlah proses worker (pre-fork, berbagi port lewat SO_REUSEPORT)')
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+        help='jumlah thread pemroses request per proses')
+    parser.add_argument('--queue-depth', type=int, default=DEFAULT_QUEUE_DEPTH,
+        help='koneksi yang boleh menunggu thread; selebihnya dijawab 503 dengan Retry-After')
+    parser.add_argument('--metrics-port', type=int, default=None,
+        help='mode --workers: port /metrics proses anak pertama, anak berikutnya +1, +2, ... '
+             '(default port + {})'.format(METRICS_PORT_OFFSET))
+    parser.add_argument('--log-level', choices=LEVELS, default='access',
+        help='off: tanpa log akses; access: satu baris per request; headers: beserta header')
+    parser.add_argument('--log-sample', type=float, default=1.0,
+        help='fraksi request sukses yang dicatat (0..1); error 5xx selalu dicatat')
+    parser.add_argument('--trace-file', default=DEFAULT_TRACE_FILE,
+        help='file trace (format Chrome trace JSON), boleh sama dengan proses lain')
+    parser.add_argument('--trace-sample', type=float, default=0.0,
+        help='fraksi request yang di-trace (0 untuk mematikan)')
+    args = parser.parse_args()
+    access_log.configure(args.log_level, args.log_sample)
+    TRACER.configure(path=args.trace_file, sample_rate=args.trace_sample)
+
     try:
-        port = int(sys.argv[1]) if len(sys.argv) > 1 else 8001
-    except (IndexError, ValueError):
-        port = 8001
-    
-    try:
-        Server(port)
+        if args.workers > 1:
+            Supervisor(args.port, args.workers, args.metrics_port, threads=args.threads, queue_depth=args.queue_depth)
+        else:
+            Server(args.port, threads=args.threads, queue_depth=args.queue_depth)
     except Exception as e:
         logging.error(f"Failed to start server: {e}")
         sys.exit(1)
@@ -0,0 +1,172 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+# File sampai batas ini disimpan di cache memori, yang lebih besar dikirim
+# langsung dari disk dengan socket.sendfile
+SMALL_FILE_LIMIT = 256 * 1024
+CACHE_MAX_BYTES = 8 * 1024 * 1024
+# Selang minimal pemeriksaan mtime direktori untuk memperbarui indeks
+INDEX_CHECK_INTERVAL = 1.0
+
+class StaticFile:
+    """Satu file di indeks beserta metadata untuk header response."""
+    def __init__(self, name, path, stat, content_type):
+        self.name = name
+        self.path = path
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.mtime = int(stat.st_mtime)
+        self.etag = '"{:x}-{:x}"'.format(self.mtime_ns, self.size)
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self.content_type = content_type
+
+    def matches(self, stat):
+        return stat.st_size == self.size and stat.st_mtime_ns == self.mtime_ns
+
+class FileResponse:
+    """Response yang body-nya dikirim langsung dari file dengan sendfile."""
+    def __init__(self, head, path, offset, count):
+        self.head = head
+        self.path = path
+        self.offset = offset
+        self.count = count
+
+    def send(self, sock):
+        sock.sendall(self.head)
+        if self.count:
+            with open(self.path, 'rb') as fp:
+                sock.sendfile(fp, self.offset, self.count)
+
+class StaticFiles:
+    """Indeks file di satu direktori (tanpa subdirektori) plus cache LRU isi
+    file kecil. Indeks dibangun ulang saat mtime direktori berubah, dan tiap
+    file dicek ulang lewat stat supaya perubahan isi langsung terlihat."""
+    def __init__(self, root='./', types=None):
+        self.root = root
+        self.types = types or {}
+        self.lock = threading.Lock()
+        self.index = {}
+        self.dir_mtime_ns = None
+        self.last_check = 0
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+
+    def content_type(self, name):
+        return self.types.get(os.path.splitext(name)[1], 'application/octet-stream')
+
+    def refresh_index_locked(self):
+        now = time.monotonic()
+        if now - self.last_check < INDEX_CHECK_INTERVAL and self.dir_mtime_ns is not None:
+            return
+        self.last_check = now
+        try:
+            dir_mtime_ns = os.stat(self.root).st_mtime_ns
+        except OSError:
+            self.index = {}
+            return
+        if dir_mtime_ns == self.dir_mtime_ns:
+            return
+        self.dir_mtime_ns = dir_mtime_ns
+        index = {}
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                # File tersembunyi (.env, .gitignore, ...) tidak disajikan
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_file():
+                        index[entry.name] = StaticFile(entry.name, entry.path, entry.stat(), self.content_type(entry.name))
+                except OSError:
+                    continue
+        self.index = index
+        for name in list(self.cache):
+            if name not in index:
+                self.drop_cached_locked(name)
+
+    def find(self, name):
+        """StaticFile untuk nama file, atau None jika tidak ada."""
+        with self.lock:
+            self.refresh_index_locked()
+            entry = self.index.get(name)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(entry.path)
+        except OSError:
+            with self.lock:
+                self.index.pop(name, None)
+                self.drop_cached_locked(name)
+            return None
+        if not entry.matches(stat):
+            entry = StaticFile(name, entry.path, stat, entry.content_type)
+            with self.lock:
+                self.index[name] = entry
+                self.drop_cached_locked(name)
+        return entry
+
+    def is_small(self, entry):
+        return entry.size <= SMALL_FILE_LIMIT
+
+    def read(self, entry):
+        """Isi file kecil, diambil dari cache jika versi (ETag) yang sama ada."""
+        with self.lock:
+            cached = self.cache.get(entry.name)
+            if cached is not None and cached[0] == entry.etag:
+                self.cache.move_to_end(entry.name)
+                return cached[1]
+        with open(entry.path, 'rb') as fp:
+            data = fp.read()
+        with self.lock:
+            self.drop_cached_locked(entry.name)
+            self.cache[entry.name] = (entry.etag, data)
+            self.cache_bytes += len(data)
+            while self.cache_bytes > CACHE_MAX_BYTES and self.cache:
+                self.drop_cached_locked(next(iter(self.cache)))
+        return data
+
+    def drop_cached_locked(self, name):
+        cached = self.cache.pop(name, None)
+        if cached is not None:
+            self.cache_bytes -= len(cached[1])
+
+def not_modified(entry, headers):
+    """True jika If-None-Match / If-Modified-Since menunjukkan client sudah punya versi ini."""
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or entry.etag in tags or 'W/' + entry.etag in tags
+    if_modified_since = headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            return entry.mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def parse_range(value, size):
+    """Header Range satu rentang byte. Mengembalikan None (kirim utuh),
+    (awal, panjang), atau False jika rentang tidak bisa dipenuhi."""
+    if not value or not value.startswith('bytes=') or ',' in value:
+        return None
+    start, sep, end = value[6:].strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if start == '':
+            # bytes=-N: N byte terakhir
+            length = int(end)
+            if length <= 0:
+                return False
+            length = min(length, size)
+            return size - length, length
+        first = int(start)
+        last = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if first >= size or last < first:
+        return False
+    last = min(last, size - 1)
+    return first, last - first + 1
@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import uuid
+import zlib
+import queue
+import logging
+import tempfile
+import threading
+
+# Header HTTP (dan field envelope JSON ke game state server) pembawa ID request
+REQUEST_ID_HEADER = 'X-Request-ID'
+REQUEST_ID_FIELD = 'request_id'
+# Di luar direktori kerja, karena direktori kerja worker adalah root file statis
+DEFAULT_TRACE_FILE = os.path.join(tempfile.gettempdir(), 'dotsandboxes-trace.json')
+QUEUE_SIZE = 10000
+
+_current = threading.local()
+
+def new_request_id():
+    return uuid.uuid4().hex[:16]
+
+def set_request_id(request_id):
+    """ID request yang sedang diproses thread ini (dibaca GameStateClient)."""
+    _current.request_id = request_id
+
+def current_request_id():
+    return getattr(_current, 'request_id', None)
+
+class Tracer:
+    """Pencatat span dalam format Chrome trace (JSON array, event "X").
+
+    Semua proses (load balancer, worker, game state server) boleh menulis ke
+    file yang sama: tiap batch ditulis dengan satu write() ke file O_APPEND.
+    File dibuka dengan "[" tanpa penutup, bentuk yang diterima chrome://tracing
+    dan Perfetto. Keputusan sampling diambil dari hash ID request sehingga
+    setiap hop dengan sample rate yang sama memilih request yang sama.
+    """
+    def __init__(self, process_name='', path=DEFAULT_TRACE_FILE, sample_rate=0.0):
+        self.process_name = process_name
+        self.path = path
+        self.sample_rate = sample_rate
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.thread = None
+        self.fd = None
+        self.pid = os.getpid()
+
+    def configure(self, process_name=None, path=None, sample_rate=None):
+        if process_name is not None:
+            self.process_name = process_name
+        if path is not None:
+            self.path = path
+        if sample_rate is not None:
+            self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+
+    @property
+    def enabled(self):
+        return self.thread is not None
+
+    def start(self):
+        # Dipanggil di tiap proses (thread dan pid tidak ikut tersalin saat fork)
+        if self.sample_rate <= 0 or not self.path:
+            return
+        self.pid = os.getpid()
+        try:
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            if os.fstat(self.fd).st_size == 0:
+                os.write(self.fd, b'[\n')
+        except OSError as e:
+            logging.error(f"Gagal membuka file trace {self.path}: {e}")
+            return
+        self.emit({'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0,
+                   'args': {'name': '{} ({})'.format(self.process_name, self.pid)}})
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        logging.info(f"Trace {self.process_name} ditulis ke {self.path} (sampling {self.sample_rate})")
+
+    def sampled(self, request_id):
+        if self.thread is None or not request_id:
+            return False
+        if self.sample_rate >= 1.0:
+            return True
+        return zlib.crc32(str(request_id).encode()) % 10000 < self.sample_rate * 10000
+
+    def span(self, name, request_id, started, args=None, ended=None):
+        """Catat span `name`; started/ended berupa nilai time.monotonic()
+        (ended default sekarang). Diabaikan jika request tidak di-sampling."""
+        if not self.sampled(request_id):
+            return
+        now = time.monotonic()
+        if ended is None:
+            ended = now
+        # Dikonversi ke jam dinding supaya span dari proses lain bisa dijajarkan
+        offset = time.time() - now
+        event = {'name': name, 'cat': self.process_name, 'ph': 'X',
+                 'ts': int((started + offset) * 1e6), 'dur': max(int((ended - started) * 1e6), 0),
+                 'pid': self.pid, 'tid': threading.get_native_id(),
+                 'args': dict(args or {}, request_id=request_id)}
+        self.emit(event)
+
+    def emit(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            pass
+
+    def run(self):
+        while True:
+            events = [self.queue.get()]
+            while len(events) < 512:
+                try:
+                    events.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            data = ''.join(json.dumps(e, separators=(',', ':')) + ',\n' for e in events).encode()
+            try:
+                os.write(self.fd, data)
+            except OSError as e:
+                logging.error(f"Gagal menulis trace: {e}")
+
+TRACER = Tracer()